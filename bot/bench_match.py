@@ -0,0 +1,90 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from matching import MatchIndex
+from metrics import percentile
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark /match queries on a synthetic MatchIndex")
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--interests', type=int, default=8, help="catalog size (at most 63)")
+    parser.add_argument('--max-per-user', type=int, default=4, help="interests per user, 1..N")
+    parser.add_argument('--active-share', type=float, default=0.3, help="share of users who have studied")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def synthetic_rows(args: argparse.Namespace, rng: random.Random) -> list[tuple]:
+    """(user_id, mask, last_active) rows like get_match_rows(), in user_id order."""
+    now = datetime.utcnow()
+    rows = []
+    for user_id in range(1, args.users + 1):
+        mask = 0
+        for interest in rng.sample(range(args.interests), rng.randint(1, args.max_per_user)):
+            mask |= 1 << interest
+        last_active = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)) \
+            if rng.random() < args.active_share else None
+        rows.append((user_id, mask, last_active))
+    return rows
+
+
+def check_order(index: MatchIndex, last_active: dict, args: argparse.Namespace, rng: random.Random) -> int:
+    """Check that matches of equal similarity come most recently active first.
+    Returns the number of violations."""
+    violations = 0
+    for _ in range(args.queries):
+        matches = index.top_k(rng.randint(1, args.users), k=50)
+        for previous, match in zip(matches, matches[1:]):
+            if previous.similarity != match.similarity:
+                continue
+            before, after = last_active.get(previous.user_id), last_active.get(match.user_id)
+            if before is None and after is not None or None not in (before, after) and before < after:
+                violations += 1
+    return violations
+
+
+def main() -> None:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    rows = synthetic_rows(args, rng)
+
+    index = MatchIndex()
+    started = time.perf_counter()
+    index.build(rows)
+    print(f"build: {len(index)} users in {time.perf_counter() - started:.2f}s")
+
+    latencies = []
+    for _ in range(args.queries):
+        user_id = rng.randint(1, args.users)
+        started = time.perf_counter()
+        index.top_k(user_id, k=args.k)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(f"top_k (k={args.k}), {args.queries} queries: p50/p95/p99/max "
+          f"{percentile(latencies, 0.5) * 1000:.3f}/{percentile(latencies, 0.95) * 1000:.3f}/"
+          f"{percentile(latencies, 0.99) * 1000:.3f}/{latencies[-1] * 1000:.3f} ms")
+
+    now = datetime.utcnow()
+    last_active = {user_id: active for user_id, _, active in rows}
+    started = time.perf_counter()
+    for _ in range(args.queries):
+        user_id = rng.randint(1, args.users)
+        index.set_mask(user_id, 1 << rng.randrange(args.interests))
+        if rng.random() < 0.5:  # Половина переходит с прежней активностью, без touch
+            index.touch(user_id, now)
+            last_active[user_id] = now
+    elapsed = time.perf_counter() - started
+    print(f"updates: {args.queries} set_mask (half with touch) in {elapsed * 1000:.1f} ms "
+          f"({elapsed / args.queries * 1e6:.1f} us each)")
+
+    violations = check_order(index, last_active, args, rng)
+    print(f"activity order after updates: {'ok' if not violations else f'{violations} violations'}")
+
+
+if __name__ == '__main__':
+    main()
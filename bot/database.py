@@ -1,13 +1,109 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import asyncio
+import os
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Column, Integer, String, Boolean, select, delete, Index, DateTime
-from typing import Optional
-from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Boolean, select, delete, update, case, func, event, bindparam, Index, DateTime,
+    inspect, text, tuple_, literal, union_all
+)
+from typing import Optional, Iterable, Callable, NamedTuple, AsyncIterator
+from datetime import datetime, timedelta, date
+from dotenv import load_dotenv
+from cache import TTLCache, MISSING
+from write_buffer import GroupCommitWriter
+from messages import INTERESTS_LIST
+
+load_dotenv()
+
+# Database settings (environment variables, see README)
+DATABASE_URL = os.getenv('BOT_DATABASE_URL', 'sqlite+aiosqlite:///bot.db')
+
+# PRAGMA для SQLite: WAL и synchronous=NORMAL убирают fsync на каждый коммит,
+# busy_timeout - ошибки "database is locked" при параллельной записи
+SQLITE_PRAGMAS = {
+    # Задаётся до создания таблиц; существующей базе нужен VACUUM (manage.py compact --vacuum)
+    'auto_vacuum': os.getenv('BOT_SQLITE_AUTO_VACUUM', 'INCREMENTAL'),
+    'journal_mode': os.getenv('BOT_SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('BOT_SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('BOT_SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'cache_size': int(os.getenv('BOT_SQLITE_CACHE_SIZE', '-65536')),  # отрицательное значение - в КиБ
+    'mmap_size': int(os.getenv('BOT_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+}
+
+def create_engine_from_env(url: str = DATABASE_URL) -> AsyncEngine:
+    """Create the async engine for `url` with pool settings from the environment.
+    SQLite connections get SQLITE_PRAGMAS applied on connect."""
+    is_sqlite = url.startswith('sqlite')
+    options = {
+        'echo': os.getenv('BOT_DB_ECHO', '0') == '1',
+        # Проверка соединения нужна серверу (обрывы по таймауту); локальному файлу SQLite это лишний запрос
+        'pool_pre_ping': os.getenv('BOT_DB_PRE_PING', '0' if is_sqlite else '1') == '1',
+    }
+    is_memory = is_sqlite and (':memory:' in url or url.rstrip('/').endswith(':'))
+    if not is_memory:
+        options.update(
+            pool_size=int(os.getenv('BOT_DB_POOL_SIZE', '5')),
+            max_overflow=int(os.getenv('BOT_DB_MAX_OVERFLOW', '10')),
+            pool_timeout=float(os.getenv('BOT_DB_POOL_TIMEOUT', '30')),
+            pool_recycle=int(os.getenv('BOT_DB_POOL_RECYCLE', '1800')),
+        )
+    new_engine = create_async_engine(url, **options)
+    
+    if is_sqlite:
+        @event.listens_for(new_engine.sync_engine, 'connect')
+        def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    
+    return new_engine
+
+def get_pool_status() -> dict:
+    """Connection pool statistics of the engine."""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
 
 # Database setup
-engine = create_async_engine('sqlite+aiosqlite:///bot.db')
+engine = create_engine_from_env()
 new_session = async_sessionmaker(engine, expire_on_commit=False)
 
+def _insert(model):
+    """INSERT with ON CONFLICT support for the engine's dialect (SQLite or PostgreSQL)."""
+    if engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# Group commit of frequent small writes; started by the bot, without it every write commits alone
+write_buffer = GroupCommitWriter(
+    new_session,
+    max_batch=int(os.getenv('BOT_WRITE_BATCH_SIZE', '64')),
+    max_delay=float(os.getenv('BOT_WRITE_BATCH_MS', '5')) / 1000
+)
+
+async def _write(op):
+    """Run op(session) and commit: through write_buffer when it runs, otherwise in its own transaction."""
+    if write_buffer.running:
+        return await write_buffer.submit(op)
+    async with new_session() as session:
+        result = await op(session)
+        await session.commit()
+        return result
+
+# Read-through caches: users by Telegram ID and interests by internal user ID
+user_cache = TTLCache(maxsize=10000, ttl=300)
+interests_cache = TTLCache(maxsize=10000, ttl=300)
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters of the user and interests caches."""
+    return {'users': user_cache.stats(), 'interests': interests_cache.stats()}
+
 # Base class for models
 class Base(DeclarativeBase):
     pass
@@ -17,11 +113,19 @@ class User(Base):
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
+    interests_mask = Column(BigInteger, nullable=False, default=0)  # Бит (id - 1) для каждого интереса из каталога
+
+# Interest model - каталог интересов; id стабильны и задают бит в User.interests_mask
+class Interest(Base):
+    __tablename__ = 'interests'
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
 
 # UserInterest model (many-to-many relationship)
 class UserInterest(Base):
@@ -30,6 +134,7 @@ class UserInterest(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False, index=True)
     interest = Column(String, nullable=False)
+    interest_id = Column(Integer, nullable=True)  # Interest.id; NULL только до миграции в init_db
     
     # Index for faster queries and unique constraint to prevent duplicates
     __table_args__ = (
@@ -46,27 +151,258 @@ class UserReminder(Base):
     last_reminder_date = Column(DateTime, nullable=True)
     next_reminder_date = Column(DateTime, nullable=True)
     is_enabled = Column(Boolean, default=True)
+    
+    # Очередь напоминаний: только включённые, в порядке срока (см. get_due_reminders)
+    __table_args__ = (
+        Index('ix_user_reminders_due', next_reminder_date, user_id,
+              sqlite_where=is_enabled.is_(True), postgresql_where=is_enabled.is_(True)),
+    )
 
 # StudyProgress model - история изучения
 class StudyProgress(Base):
     __tablename__ = 'study_progress'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False)  # Telegram ID пользователя
     topic = Column(String, nullable=False)  # Что изучил
     study_time_minutes = Column(Integer, nullable=False)  # Сколько времени потратил (в минутах)
     date = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Composite index serves both per-user aggregates and "latest entries" queries
+    __table_args__ = (
+        Index('ix_study_progress_user_date', 'user_id', 'date'),
+    )
+
+# StudyTotals model - накопительные итоги изучения по пользователю
+class StudyTotals(Base):
+    __tablename__ = 'study_totals'
+    
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram ID, как в study_progress
+    total_minutes = Column(Integer, nullable=False, default=0)
+    entry_count = Column(Integer, nullable=False, default=0)
+    last_study_date = Column(DateTime, nullable=True)
+    current_streak = Column(Integer, nullable=False, default=0)  # Дней подряд с занятиями
+
+# StudySummary model - старые записи study_progress, свёрнутые в итог за месяц по теме
+class StudySummary(Base):
+    __tablename__ = 'study_summaries'
+    
+    user_id = Column(BigInteger, primary_key=True)  # Telegram ID, как в study_progress
+    month = Column(DateTime, primary_key=True)  # Первое число месяца
+    topic = Column(String, primary_key=True)
+    study_time_minutes = Column(Integer, nullable=False, default=0)
+    entry_count = Column(Integer, nullable=False, default=0)  # Сколько записей свёрнуто
+    last_date = Column(DateTime, nullable=False)
+
+# ConversationStateRow model - незавершённые диалоги, чтобы они переживали перезапуск бота
+class ConversationStateRow(Base):
+    __tablename__ = 'conversation_states'
+    
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram ID
+    kind = Column(String, nullable=False)
+    topic = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Interest catalog: name <-> id, loaded by init_db()
+MAX_INTEREST_ID = 63  # interests_mask - знаковое 64-битное целое
+interest_ids: dict[str, int] = {}
+interest_names: dict[int, str] = {}
+
+def interests_to_mask(interests: Iterable[str]) -> int:
+    """Bitmask of interest names; names missing from the catalog are ignored."""
+    mask = 0
+    for name in interests:
+        interest_id = interest_ids.get(name)
+        if interest_id is not None:
+            mask |= 1 << (interest_id - 1)
+    return mask
+
+def mask_to_interests(mask: int) -> list[str]:
+    """Interest names of a bitmask, in catalog order."""
+    interests = []
+    while mask:
+        low_bit = mask & -mask
+        interests.append(interest_names[low_bit.bit_length()])
+        mask ^= low_bit
+    return interests
+
+async def _sync_interest_catalog(conn, extra_names: Iterable[str] = ()) -> None:
+    """Add missing interests to the catalog (INTERESTS_LIST keeps its numbering as ids)
+    and load it into interest_ids/interest_names."""
+    result = await conn.execute(select(Interest.id, Interest.name))
+    catalog = {name: interest_id for interest_id, name in result.all()}
+    used_ids = set(catalog.values())
+    new_rows = []
+    for number, name in [*enumerate(INTERESTS_LIST, 1), *((None, name) for name in extra_names)]:
+        if name in catalog:
+            continue
+        interest_id = number if number is not None and number not in used_ids else max(used_ids, default=0) + 1
+        catalog[name] = interest_id
+        used_ids.add(interest_id)
+        new_rows.append({'id': interest_id, 'name': name})
+    if max(catalog.values(), default=0) > MAX_INTEREST_ID:
+        raise RuntimeError(f"Interest catalog exceeds {MAX_INTEREST_ID} entries, interests_mask cannot hold it")
+    if new_rows:
+        await conn.execute(Interest.__table__.insert(), new_rows)
+    interest_ids.clear()
+    interest_ids.update(catalog)
+    interest_names.clear()
+    interest_names.update({interest_id: name for name, interest_id in catalog.items()})
+
+def _missing_interest_columns(conn) -> list[str]:
+    """ALTER statements for interest columns absent in databases created before the catalog."""
+    inspector = inspect(conn)
+    statements = []
+    if 'interests_mask' not in {c['name'] for c in inspector.get_columns('users')}:
+        statements.append("ALTER TABLE users ADD COLUMN interests_mask BIGINT NOT NULL DEFAULT 0")
+    if 'interest_id' not in {c['name'] for c in inspector.get_columns('user_interests')}:
+        statements.append("ALTER TABLE user_interests ADD COLUMN interest_id INTEGER")
+    return statements
+
+async def _migrate_interests(conn) -> None:
+    """Fill the catalog, user_interests.interest_id and users.interests_mask from the
+    free-text rows. Unknown names are added to the catalog, so no interest is lost."""
+    result = await conn.execute(
+        select(UserInterest.id, UserInterest.user_id, UserInterest.interest)
+        .where(UserInterest.interest_id.is_(None))
+    )
+    rows = result.all()
+    await _sync_interest_catalog(conn, extra_names=dict.fromkeys(row.interest for row in rows))
+    if not rows:
+        return
+    
+    table = UserInterest.__table__
+    await conn.execute(
+        table.update().where(table.c.id == bindparam('b_id')).values(interest_id=bindparam('b_interest_id')),
+        [{'b_id': row.id, 'b_interest_id': interest_ids[row.interest]} for row in rows]
+    )
+    result = await conn.execute(select(UserInterest.user_id, UserInterest.interest_id))
+    masks: dict[int, int] = {}
+    for user_id, interest_id in result.all():
+        masks[user_id] = masks.get(user_id, 0) | 1 << (interest_id - 1)
+    users = User.__table__
+    await conn.execute(
+        users.update().where(users.c.id == bindparam('b_id')).values(interests_mask=bindparam('b_mask')),
+        [{'b_id': user_id, 'b_mask': mask} for user_id, mask in masks.items()]
+    )
+    import logging
+    logging.getLogger(__name__).info(f"Migrated {len(rows)} interests of {len(masks)} users to the catalog")
+
+# OutboxMessage model - исходящие сообщения бота, доставляются outbox.OutboxWorker
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)  # Telegram ID
+    kind = Column(String, nullable=False)  # reminder, message...
+    text = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claimed_until = Column(DateTime, nullable=True)  # Аренда строки воркером
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+# SchemaVersion model - применённые миграции схемы (см. MIGRATIONS)
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 # Initialize database
+def _create_indexes(conn, names: Iterable[str]) -> None:
+    # create_all() skips indexes of tables that already exist
+    names = set(names)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+async def _migration_interest_catalog(conn) -> None:
+    # Databases from before schema versioning: interest columns, indexes added since, catalog
+    for statement in await conn.run_sync(_missing_interest_columns):
+        await conn.execute(text(statement))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_study_progress_user_id"))  # Покрыт ix_study_progress_user_date
+    await conn.run_sync(_create_indexes, [
+        'ix_user_interests_user_id', 'ix_user_interest_unique', 'ix_user_reminders_user_id',
+        'ix_study_progress_user_date', 'ix_conversation_states_expires_at', 'ix_outbox_status_next_attempt',
+    ])
+    await _migrate_interests(conn)
+
+async def _migration_due_reminders_index(conn) -> None:
+    await conn.run_sync(_create_indexes, ['ix_user_reminders_due'])
+
+# Колонки с Telegram ID: ID пользователей бывают больше 2^31
+TELEGRAM_ID_COLUMNS = [
+    ('users', 'telegram_id'), ('study_progress', 'user_id'), ('study_totals', 'user_id'),
+    ('study_summaries', 'user_id'), ('conversation_states', 'user_id'), ('outbox', 'chat_id'),
+]
+
+async def _migration_bigint_telegram_ids(conn) -> None:
+    # В SQLite INTEGER и так 64-битный, менять тип нужно только на сервере
+    if conn.dialect.name != 'postgresql':
+        return
+    for table, column in TELEGRAM_ID_COLUMNS:
+        await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT"))
+
+# Миграции по порядку: (версия, описание, функция). Только добавлять в конец, не менять применённые.
+# Каждая идемпотентна: новая база получает всю схему от create_all() и проходит их без изменений.
+MIGRATIONS = [
+    (1, "interest catalog and interests_mask, indexes added before versioning", _migration_interest_catalog),
+    (2, "partial index on enabled reminders by next_reminder_date", _migration_due_reminders_index),
+    (3, "64-bit Telegram ID columns", _migration_bigint_telegram_ids),
+]
+
+async def _migrate_schema() -> int:
+    """Apply pending MIGRATIONS, each in its own transaction. Returns the schema version."""
+    import logging
+    logger = logging.getLogger(__name__)
+    async with engine.begin() as conn:
+        current = await conn.scalar(select(func.max(SchemaVersion.version))) or 0
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        async with engine.begin() as conn:
+            await migrate(conn)
+            await conn.execute(
+                SchemaVersion.__table__.insert(),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        current = version
+        logger.info(f"Applied schema migration {version}: {description}")
+    return current
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await _migrate_schema()
+    async with engine.begin() as conn:
+        await _sync_interest_catalog(conn)
+    
+    # Backfill rollups for databases created before study_totals existed
+    async with new_session() as session:
+        has_totals = await session.scalar(select(StudyTotals.user_id).limit(1))
+        has_progress = await session.scalar(select(StudyProgress.id).limit(1))
+    if has_progress is not None and has_totals is None:
+        await rebuild_study_totals()
 
 # Database helper functions
 async def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
+    cached = user_cache.get(telegram_id)
+    if cached is not MISSING:
+        return cached
     async with new_session() as session:
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        return result.scalar_one_or_none()
+        user = result.scalar_one_or_none()
+    user_cache.set(telegram_id, user)
+    return user
 
 async def create_user(telegram_id: int, username: Optional[str] = None, 
                     first_name: Optional[str] = None, last_name: Optional[str] = None) -> User:
@@ -80,41 +416,102 @@ async def create_user(telegram_id: int, username: Optional[str] = None,
         session.add(user)
         await session.commit()
         await session.refresh(user)
-        return user
+    user_cache.set(telegram_id, user)
+    return user
 
 async def get_user_interests(user_id: int) -> list[str]:
+    cached = interests_cache.get(user_id)
+    if cached is not MISSING:
+        return list(cached)
     async with new_session() as session:
-        result = await session.execute(
-            select(UserInterest.interest).where(UserInterest.user_id == user_id)
-        )
-        return [row[0] for row in result.fetchall()]
+        mask = await session.scalar(select(User.interests_mask).where(User.id == user_id))
+    interests = mask_to_interests(mask or 0)
+    interests_cache.set(user_id, tuple(interests))
+    return interests
 
-async def save_user_interests(user_id: int, interests: list[str]) -> bool:
-    """Save user interests to database. Replaces existing interests with new ones.
-    Returns True if successful, False otherwise."""
-    try:
-        async with new_session() as session:
-            # Remove existing interests using bulk delete (more efficient)
+# Подписчики на изменения данных пользователей (планировщик напоминаний, индекс /match)
+_reminder_listeners: list[Callable[[int, Optional[datetime]], None]] = []
+_interests_listeners: list[Callable[[int, int], None]] = []
+_study_listeners: list[Callable[[int, 'StudyProgress'], None]] = []
+
+def add_reminder_listener(listener: Callable[[int, Optional[datetime]], None]) -> None:
+    """Register a callback called as listener(user_id, next_reminder_date) after a reminder changes."""
+    _reminder_listeners.append(listener)
+
+def add_interests_listener(listener: Callable[[int, int], None]) -> None:
+    """Register a callback called as listener(telegram_id, interests_mask) after interests change."""
+    _interests_listeners.append(listener)
+
+def add_study_listener(listener: Callable[[int, 'StudyProgress'], None]) -> None:
+    """Register a callback called as listener(telegram_id, progress) after a StudyProgress is saved."""
+    _study_listeners.append(listener)
+
+def _notify_listeners(listeners: list[Callable], user_id: int, value) -> None:
+    for listener in listeners:
+        try:
+            listener(user_id, value)
+        except Exception as e:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error(f"Error in listener {listener!r} for user {user_id}: {e}", exc_info=True)
+
+def _notify_reminder_change(user_id: int, next_date: Optional[datetime]) -> None:
+    _notify_listeners(_reminder_listeners, user_id, next_date)
+
+class InterestsChange(NamedTuple):
+    """Result of save_user_interests: the stored interests and what changed."""
+    interests: list[str]
+    added: list[str]
+    removed: list[str]
+
+async def save_user_interests(user_id: int, interests: list[str]) -> Optional[InterestsChange]:
+    """Save user interests to database. Replaces existing interests with new ones:
+    users.interests_mask is rewritten and only the changed user_interests rows are touched.
+    Interests missing from the catalog are ignored.
+    Returns the change if successful, None otherwise."""
+    new_mask = interests_to_mask(interests)
+    
+    async def write(session):
+        old_mask = await session.scalar(select(User.interests_mask).where(User.id == user_id)) or 0
+        added = mask_to_interests(new_mask & ~old_mask)
+        removed = mask_to_interests(old_mask & ~new_mask)
+        
+        if removed:
             await session.execute(
-                delete(UserInterest).where(UserInterest.user_id == user_id)
+                delete(UserInterest).where(
+                    UserInterest.user_id == user_id,
+                    UserInterest.interest.in_(removed)
+                )
             )
-            # Flush to ensure delete is executed before adding new records
-            # This prevents unique constraint violations when re-adding the same interests
-            await session.flush()
-            
-            # Add new interests
-            if interests:
-                for interest in interests:
-                    user_interest = UserInterest(user_id=user_id, interest=interest)
-                    session.add(user_interest)
-            
-            await session.commit()
-            return True
+        if added:
+            await session.execute(
+                _insert(UserInterest)
+                .values([{'user_id': user_id, 'interest': i, 'interest_id': interest_ids[i]} for i in added])
+                .on_conflict_do_nothing(index_elements=['user_id', 'interest'])
+            )
+        telegram_id = None
+        if added or removed:
+            result = await session.execute(
+                update(User).where(User.id == user_id).values(interests_mask=new_mask)
+                .returning(User.telegram_id)
+            )
+            telegram_id = result.scalar_one_or_none()
+        return added, removed, telegram_id
+    
+    try:
+        added, removed, telegram_id = await _write(write)
+        if telegram_id is not None:
+            user_cache.invalidate(telegram_id)  # В кэше лежит User со старой маской
+            _notify_listeners(_interests_listeners, telegram_id, new_mask)
+        change = InterestsChange(interests=mask_to_interests(new_mask), added=added, removed=removed)
+        interests_cache.set(user_id, tuple(change.interests))
+        return change
     except Exception as e:
+        interests_cache.invalidate(user_id)
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Error saving interests for user {user_id}: {e}", exc_info=True)
-        return False
+        return None
 
 # Reminder functions
 async def get_user_reminder(user_id: int) -> Optional[UserReminder]:
@@ -126,100 +523,562 @@ async def get_user_reminder(user_id: int) -> Optional[UserReminder]:
         return result.scalar_one_or_none()
 
 async def create_or_update_reminder(user_id: int, interval_days: int) -> bool:
-    """Create or update user reminder settings."""
+    """Create or update user reminder settings with a single upsert."""
     try:
+        next_date = datetime.utcnow() + timedelta(days=interval_days)
+        stmt = _insert(UserReminder).values(
+            user_id=user_id,
+            reminder_interval_days=interval_days,
+            next_reminder_date=next_date,
+            is_enabled=True
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={
+                'reminder_interval_days': stmt.excluded.reminder_interval_days,
+                'next_reminder_date': stmt.excluded.next_reminder_date,
+                'is_enabled': True
+            }
+        )
         async with new_session() as session:
-            result = await session.execute(
-                select(UserReminder).where(UserReminder.user_id == user_id)
-            )
-            reminder = result.scalar_one_or_none()
-            
-            if reminder:
-                reminder.reminder_interval_days = interval_days
-                reminder.next_reminder_date = datetime.utcnow() + timedelta(days=interval_days)
-                reminder.is_enabled = True
-            else:
-                reminder = UserReminder(
-                    user_id=user_id,
-                    reminder_interval_days=interval_days,
-                    next_reminder_date=datetime.utcnow() + timedelta(days=interval_days),
-                    is_enabled=True
-                )
-                session.add(reminder)
-            
+            await session.execute(stmt)
             await session.commit()
-            return True
+        _notify_reminder_change(user_id, next_date)
+        return True
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Error saving reminder for user {user_id}: {e}", exc_info=True)
         return False
 
-async def update_reminder_date(user_id: int, new_date: datetime) -> bool:
-    """Update last and next reminder dates."""
+REMINDER_INTERVALS = range(1, 8)  # Допустимые интервалы напоминаний, дней
+
+async def advance_reminder_date(user_id: int) -> Optional[datetime]:
+    """Move an enabled reminder to now + its interval with a single UPDATE ... RETURNING.
+    Returns the new next_reminder_date, or None if the user has no enabled reminder."""
+    now = datetime.utcnow()
+    # Интервал берётся из самой строки: дата считается в SQL без предварительного SELECT
+    next_date = case(
+        {days: now + timedelta(days=days) for days in REMINDER_INTERVALS},
+        value=UserReminder.reminder_interval_days,
+        else_=UserReminder.next_reminder_date
+    )
+    async def write(session):
+        result = await session.execute(
+            update(UserReminder)
+            .where(UserReminder.user_id == user_id, UserReminder.is_enabled.is_(True))
+            .values(last_reminder_date=now, next_reminder_date=next_date)
+            .returning(UserReminder.next_reminder_date)
+        )
+        return result.scalar_one_or_none()
+    
     try:
-        async with new_session() as session:
-            result = await session.execute(
-                select(UserReminder).where(UserReminder.user_id == user_id)
-            )
-            reminder = result.scalar_one_or_none()
-            if reminder:
-                reminder.last_reminder_date = datetime.utcnow()
-                reminder.next_reminder_date = new_date
-                await session.commit()
-                return True
-            return False
+        new_date = await _write(write)
+        if new_date is not None:
+            _notify_reminder_change(user_id, new_date)
+        return new_date
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Error updating reminder date for user {user_id}: {e}", exc_info=True)
-        return False
+        return None
 
-async def get_users_due_for_reminder() -> list[UserReminder]:
-    """Get all users who are due for a reminder."""
+def _due_reminders_query(now: datetime):
+    return (
+        select(
+            UserReminder.user_id,
+            User.telegram_id,
+            User.first_name,
+            UserReminder.reminder_interval_days,
+            UserReminder.next_reminder_date
+        )
+        .join(User, User.id == UserReminder.user_id)
+        .where(
+            UserReminder.is_enabled.is_(True),
+            UserReminder.next_reminder_date <= now
+        )
+    )
+
+async def iter_due_reminders(page_size: int = 1000) -> AsyncIterator[list]:
+    """Yield due reminders (rows as in get_due_reminders) in pages of up to page_size.
+    Keyset pagination in (next_reminder_date, user_id) order over ix_user_reminders_due:
+    each page starts after the last row of the previous one, so memory stays bounded
+    and rows the caller has already rescheduled are not skipped or read twice."""
+    now = datetime.utcnow()
+    query = (
+        _due_reminders_query(now)
+        .order_by(UserReminder.next_reminder_date, UserReminder.user_id)
+        .limit(page_size)
+    )
+    page_query = query
+    while True:
+        async with new_session() as session:
+            result = await session.execute(page_query)
+            rows = list(result.all())
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+        page_query = query.where(
+            tuple_(UserReminder.next_reminder_date, UserReminder.user_id) > (last.next_reminder_date, last.user_id)
+        )
+
+async def get_due_reminders(user_ids: Optional[Iterable[int]] = None, batch_size: int = 500) -> list:
+    """Get due reminders joined with the user fields needed for the message.
+    Each row has user_id, telegram_id, first_name, reminder_interval_days and next_reminder_date.
+    If user_ids is given, only those users are checked (one query per batch_size IDs);
+    to go through all due users, iter_due_reminders() keeps memory bounded."""
+    if user_ids is None:
+        return [row async for page in iter_due_reminders(batch_size) for row in page]
+    
+    query = _due_reminders_query(datetime.utcnow())
+    user_ids = list(user_ids)
+    rows = []
     async with new_session() as session:
-        now = datetime.utcnow()
+        for start in range(0, len(user_ids), batch_size):
+            result = await session.execute(
+                query.where(UserReminder.user_id.in_(user_ids[start:start + batch_size]))
+            )
+            rows.extend(result.all())
+    return rows
+
+async def get_reminder_schedule(until: datetime, after: Optional[datetime] = None) -> list:
+    """Get (user_id, next_reminder_date) of enabled reminders due before `until`
+    (and after `after`, if given)."""
+    query = select(UserReminder.user_id, UserReminder.next_reminder_date).where(
+        UserReminder.is_enabled.is_(True),
+        UserReminder.next_reminder_date <= until
+    )
+    if after is not None:
+        query = query.where(UserReminder.next_reminder_date > after)
+    async with new_session() as session:
+        result = await session.execute(query)
+        return list(result.all())
+
+async def _mark_reminders_sent(session, reminders: list, now: datetime, batch_size: int) -> int:
+    """Set last_reminder_date to now and move next_reminder_date by each reminder's interval,
+    one UPDATE per batch_size rows with user_id and reminder_interval_days."""
+    updated = 0
+    for start in range(0, len(reminders), batch_size):
+        batch = reminders[start:start + batch_size]
+        intervals = {r.reminder_interval_days for r in batch}
+        # Если интервал успели изменить, create_or_update_reminder уже выставил новую дату
+        next_date = case(
+            {days: now + timedelta(days=days) for days in intervals},
+            value=UserReminder.reminder_interval_days,
+            else_=UserReminder.next_reminder_date
+        )
         result = await session.execute(
-            select(UserReminder).where(
-                UserReminder.is_enabled.is_(True),
-                UserReminder.next_reminder_date <= now
+            update(UserReminder)
+            .where(UserReminder.user_id.in_([r.user_id for r in batch]))
+            .values(last_reminder_date=now, next_reminder_date=next_date)
+        )
+        updated += result.rowcount
+    return updated
+
+async def queue_reminders(reminders: Iterable, texts: Iterable[str], batch_size: int = 500) -> int:
+    """Put reminder messages into the outbox and mark the reminders as sent in one transaction,
+    so every due reminder is queued exactly once. `texts` go with `reminders` in order.
+    Returns the number of queued messages; exceptions are raised to the caller."""
+    reminders = list(reminders)
+    if not reminders:
+        return 0
+    now = datetime.utcnow()
+    rows = [
+        {'chat_id': r.telegram_id, 'kind': 'reminder', 'text': text, 'status': 'pending',
+         'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+        for r, text in zip(reminders, texts)
+    ]
+    async with new_session() as session:
+        for start in range(0, len(rows), batch_size):
+            await session.execute(OutboxMessage.__table__.insert(), rows[start:start + batch_size])
+        await _mark_reminders_sent(session, reminders, now, batch_size)
+        await session.commit()
+    for r in reminders:
+        _notify_reminder_change(r.user_id, now + timedelta(days=r.reminder_interval_days))
+    return len(rows)
+
+# Outbox functions
+async def claim_outbox_batch(limit: int, lease: timedelta) -> list:
+    """Claim up to `limit` messages that are due: pending ones and those whose worker lease
+    expired (the worker died mid-send). Claimed rows get status 'sending' until now + lease.
+    On PostgreSQL concurrent workers skip each other's rows (FOR UPDATE SKIP LOCKED)."""
+    now = datetime.utcnow()
+    due = (
+        select(OutboxMessage.id)
+        .where(
+            ((OutboxMessage.status == 'pending') & (OutboxMessage.next_attempt_at <= now))
+            | ((OutboxMessage.status == 'sending') & (OutboxMessage.claimed_until < now))
+        )
+        .order_by(OutboxMessage.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with new_session() as session:
+        result = await session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due.scalar_subquery()))
+            .values(status='sending', claimed_until=now + lease)
+            .returning(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.kind,
+                       OutboxMessage.text, OutboxMessage.attempts)
+        )
+        rows = list(result.all())
+        await session.commit()
+    return rows
+
+async def complete_outbox(sent_ids: Iterable[int], retries: Iterable[tuple[int, datetime, str]] = (),
+                          failures: Iterable[tuple[int, str]] = ()) -> None:
+    """Record delivery results of claimed messages: sent, retry at a time with the error,
+    or failed permanently. Retried and failed messages count one more attempt."""
+    sent_ids, retries, failures = list(sent_ids), list(retries), list(failures)
+    table = OutboxMessage.__table__
+    now = datetime.utcnow()
+    async with new_session() as session:
+        if sent_ids:
+            await session.execute(
+                update(OutboxMessage).where(OutboxMessage.id.in_(sent_ids))
+                .values(status='sent', sent_at=now, claimed_until=None)
             )
+        if retries:
+            await session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    status='pending', attempts=table.c.attempts + 1, claimed_until=None,
+                    next_attempt_at=bindparam('b_next'), last_error=bindparam('b_error')
+                ),
+                [{'b_id': i, 'b_next': next_at, 'b_error': error} for i, next_at, error in retries]
+            )
+        if failures:
+            await session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    status='failed', attempts=table.c.attempts + 1, claimed_until=None,
+                    last_error=bindparam('b_error')
+                ),
+                [{'b_id': i, 'b_error': error} for i, error in failures]
+            )
+        await session.commit()
+
+async def get_outbox_counts() -> dict[str, int]:
+    """Number of outbox messages by status."""
+    async with new_session() as session:
+        result = await session.execute(
+            select(OutboxMessage.status, func.count()).group_by(OutboxMessage.status)
         )
-        return list(result.scalars().all())
+        return dict(result.all())
+
+async def delete_sent_outbox(older_than: datetime) -> int:
+    """Delete messages delivered before `older_than`. Returns the number of deleted rows."""
+    async with new_session() as session:
+        result = await session.execute(
+            delete(OutboxMessage).where(OutboxMessage.status == 'sent', OutboxMessage.sent_at < older_than)
+        )
+        await session.commit()
+        return result.rowcount
 
 # Study progress functions
 async def save_study_progress(user_id: int, topic: str, study_time_minutes: int) -> bool:
-    """Save study progress entry."""
-    try:
-        async with new_session() as session:
-            progress = StudyProgress(
+    """Save study progress entry and update the user's study_totals row in the same transaction."""
+    async def write(session):
+        now = datetime.utcnow()
+        progress = StudyProgress(
+            user_id=user_id,
+            topic=topic,
+            study_time_minutes=study_time_minutes,
+            date=now
+        )
+        session.add(progress)
+        
+        totals = await session.get(StudyTotals, user_id)
+        if totals is None:
+            session.add(StudyTotals(
                 user_id=user_id,
-                topic=topic,
-                study_time_minutes=study_time_minutes,
-                date=datetime.utcnow()
-            )
-            session.add(progress)
-            await session.commit()
-            return True
+                total_minutes=study_time_minutes,
+                entry_count=1,
+                last_study_date=now,
+                current_streak=1
+            ))
+        else:
+            last_day = totals.last_study_date.date() if totals.last_study_date else None
+            if last_day != now.date():
+                continuing = last_day == now.date() - timedelta(days=1)
+                totals.current_streak = totals.current_streak + 1 if continuing else 1
+            # Счётчики обновляются выражениями SQL, чтобы параллельные записи не терялись
+            totals.total_minutes = StudyTotals.total_minutes + study_time_minutes
+            totals.entry_count = StudyTotals.entry_count + 1
+            totals.last_study_date = now
+        return progress
+    
+    try:
+        progress = await _write(write)
+        _notify_listeners(_study_listeners, user_id, progress)
+        return True
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Error saving study progress for user {user_id}: {e}", exc_info=True)
         return False
 
+async def get_match_rows() -> list:
+    """(telegram_id, interests_mask, last_study_date) of active users with interests."""
+    async with new_session() as session:
+        result = await session.execute(
+            select(User.telegram_id, User.interests_mask, StudyTotals.last_study_date)
+            .outerjoin(StudyTotals, StudyTotals.user_id == User.telegram_id)
+            .where(User.is_active.is_not(False), User.interests_mask != 0)
+        )
+        return list(result.all())
+
+async def get_users_by_telegram_ids(telegram_ids: Iterable[int]) -> dict[int, User]:
+    """Users by Telegram ID for the given IDs (missing ones are left out)."""
+    telegram_ids = list(telegram_ids)
+    if not telegram_ids:
+        return {}
+    async with new_session() as session:
+        result = await session.execute(select(User).where(User.telegram_id.in_(telegram_ids)))
+        return {user.telegram_id: user for user in result.scalars()}
+
+class LeaderboardData(NamedTuple):
+    """Input of leaderboard.Leaderboards.build(); all user IDs are Telegram IDs."""
+    last_entry_id: int
+    masks: list       # (user_id, interests_mask)
+    totals: list      # (user_id, total_minutes)
+    daily: list       # (user_id, day, minutes) since the requested date
+
+async def get_leaderboard_data(since: datetime) -> LeaderboardData:
+    """Study minutes for rebuilding leaderboards: all-time totals and per-day sums since `since`.
+    Per-day sums cover entries up to last_entry_id, newer entries are replayed by the caller.
+    Totals are read first, so they never count an entry twice; an entry saved between
+    the two reads is missing from the all-time totals until the next rebuild."""
+    async with new_session() as session:
+        totals = (await session.execute(select(StudyTotals.user_id, StudyTotals.total_minutes))).all()
+        last_entry_id = await session.scalar(select(func.max(StudyProgress.id))) or 0
+        masks = (await session.execute(
+            select(User.telegram_id, User.interests_mask).where(User.interests_mask != 0)
+        )).all()
+        day = func.date(StudyProgress.date)
+        result = await session.execute(
+            select(StudyProgress.user_id, day, func.sum(StudyProgress.study_time_minutes))
+            .where(StudyProgress.date >= since, StudyProgress.id <= last_entry_id)
+            .group_by(StudyProgress.user_id, day)
+        )
+        daily = [(user_id, _as_date(value), minutes) for user_id, value, minutes in result.all()]
+    return LeaderboardData(last_entry_id, list(masks), list(totals), daily)
+
+async def get_study_totals(user_id: int) -> dict:
+    """Get user study totals from the study_totals rollup (one row, no aggregation).
+    Returns the same totals keys as get_user_study_stats plus last_study_date and current_streak."""
+    async with new_session() as session:
+        totals = await session.get(StudyTotals, user_id)
+    if totals is None:
+        return {'total_time_minutes': 0, 'total_topics': 0, 'last_study_date': None, 'current_streak': 0}
+    
+    # Серия прерывается, если последний раз занимались раньше, чем вчера
+    streak = totals.current_streak
+    if totals.last_study_date and totals.last_study_date.date() < datetime.utcnow().date() - timedelta(days=1):
+        streak = 0
+    return {
+        'total_time_minutes': totals.total_minutes,
+        'total_topics': totals.entry_count,
+        'last_study_date': totals.last_study_date,
+        'current_streak': streak
+    }
+
+def _as_date(value) -> date:
+    # SQLite возвращает date() строкой, PostgreSQL - объектом date
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+async def rebuild_study_totals(batch_size: int = 1000) -> int:
+    """Recompute study_totals for all users from study_progress and study_summaries.
+    Streaks are counted from study_progress only. Returns the number of users."""
+    entries = _study_entries().subquery()
+    async with new_session() as session:
+        result = await session.execute(
+            select(
+                entries.c.user_id,
+                func.sum(entries.c.minutes),
+                func.sum(entries.c.entry_count),
+                func.max(entries.c.date)
+            ).group_by(entries.c.user_id)
+        )
+        totals = {
+            row[0]: {'user_id': row[0], 'total_minutes': row[1], 'entry_count': row[2],
+                     'last_study_date': row[3], 'current_streak': 0}
+            for row in result.all()
+        }
+        
+        # Серия = число подряд идущих дней, заканчивающихся днём последнего занятия
+        days = await session.stream(
+            select(StudyProgress.user_id, func.date(StudyProgress.date).label('day'))
+            .distinct()
+            .order_by(StudyProgress.user_id, func.date(StudyProgress.date).desc())
+        )
+        current_user, expected_day = None, None
+        async for user_id, day in days:
+            day = _as_date(day)
+            if user_id != current_user:
+                current_user, expected_day = user_id, day
+            if day == expected_day:
+                totals[user_id]['current_streak'] += 1
+                expected_day = day - timedelta(days=1)
+        
+        await session.execute(delete(StudyTotals))
+        rows = list(totals.values())
+        for start in range(0, len(rows), batch_size):
+            await session.execute(StudyTotals.__table__.insert(), rows[start:start + batch_size])
+        await session.commit()
+        return len(rows)
+
+def _study_entries(user_id: Optional[int] = None):
+    """study_progress entries and compacted study_summaries as one set of
+    (user_id, minutes, entry_count, date) rows."""
+    detail = select(
+        StudyProgress.user_id, StudyProgress.study_time_minutes.label('minutes'),
+        literal(1).label('entry_count'), StudyProgress.date.label('date')
+    )
+    summaries = select(
+        StudySummary.user_id, StudySummary.study_time_minutes, StudySummary.entry_count, StudySummary.last_date
+    )
+    if user_id is not None:
+        detail = detail.where(StudyProgress.user_id == user_id)
+        summaries = summaries.where(StudySummary.user_id == user_id)
+    return union_all(detail, summaries)
+
 async def get_user_study_stats(user_id: int) -> dict:
-    """Get user study statistics."""
+    """Get user study statistics: totals are aggregated in SQL, plus the 10 latest entries.
+    Totals include compacted entries; both tables are read by one statement, so a
+    compaction running at the same time never shows up as a change in the totals."""
+    entries = _study_entries(user_id).subquery()
     async with new_session() as session:
         result = await session.execute(
-            select(StudyProgress).where(StudyProgress.user_id == user_id)
+            select(
+                func.coalesce(func.sum(entries.c.minutes), 0),
+                func.coalesce(func.sum(entries.c.entry_count), 0)
+            )
         )
-        progress_list = list(result.scalars().all())
+        total_time, total_topics = result.one()
         
-        total_time = sum(p.study_time_minutes for p in progress_list)
-        total_topics = len(progress_list)
+        result = await session.execute(
+            select(StudyProgress)
+            .where(StudyProgress.user_id == user_id)
+            .order_by(StudyProgress.date.desc())
+            .limit(10)
+        )
         
         return {
             'total_time_minutes': total_time,
             'total_topics': total_topics,
-            'entries': progress_list[-10:]  # Последние 10 записей
+            'entries': list(result.scalars().all())  # Последние 10 записей, новые первыми
+        }
+
+# Compaction of old study progress
+# /top считает окна 7 и 30 дней по подробным записям, их свёртывать нельзя
+MIN_STUDY_RETENTION = timedelta(days=31)
+
+async def compact_study_progress(older_than: datetime, batch_size: int = 1000, pause: float = 0.05) -> int:
+    """Fold study_progress entries of the months before `older_than` into study_summaries
+    (one row per user, month and topic) and delete them.
+    
+    Works in transactions of batch_size entries, each adding to the summaries and deleting
+    the entries it folded, so totals stay the same at every moment and no write lock is
+    held for long; `pause` seconds between batches let other writers in.
+    Returns the number of compacted entries."""
+    if datetime.utcnow() - older_than < MIN_STUDY_RETENTION:
+        raise ValueError(f"Entries newer than {MIN_STUDY_RETENTION.days} days are needed for leaderboards")
+    cutoff = datetime(older_than.year, older_than.month, 1)
+    
+    insert = _insert(StudySummary)
+    upsert = insert.on_conflict_do_update(
+        index_elements=['user_id', 'month', 'topic'],
+        set_={
+            'study_time_minutes': StudySummary.study_time_minutes + insert.excluded.study_time_minutes,
+            'entry_count': StudySummary.entry_count + insert.excluded.entry_count,
+            'last_date': case(
+                (insert.excluded.last_date > StudySummary.last_date, insert.excluded.last_date),
+                else_=StudySummary.last_date
+            ),
         }
+    )
+    compacted = 0
+    while True:
+        async with new_session() as session:
+            result = await session.execute(
+                select(StudyProgress.id, StudyProgress.user_id, StudyProgress.topic,
+                       StudyProgress.study_time_minutes, StudyProgress.date)
+                .where(StudyProgress.date < cutoff)
+                .order_by(StudyProgress.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            summaries: dict[tuple, dict] = {}
+            for row in rows:
+                month = datetime(row.date.year, row.date.month, 1)
+                summary = summaries.setdefault((row.user_id, month, row.topic), {
+                    'user_id': row.user_id, 'month': month, 'topic': row.topic,
+                    'study_time_minutes': 0, 'entry_count': 0, 'last_date': row.date
+                })
+                summary['study_time_minutes'] += row.study_time_minutes
+                summary['entry_count'] += 1
+                summary['last_date'] = max(summary['last_date'], row.date)
+            deleted = await session.execute(
+                delete(StudyProgress).where(StudyProgress.id.in_([row.id for row in rows]))
+            )
+            if deleted.rowcount != len(rows):
+                await session.rollback()  # Часть записей уже свернул другой процесс: перечитать
+                continue
+            await session.execute(upsert, list(summaries.values()))
+            await session.commit()
+        compacted += len(rows)
+        await asyncio.sleep(pause)
+    return compacted
+
+async def vacuum_free_pages(step: int = 1000, pause: float = 0.05) -> int:
+    """Return free pages of an SQLite database in auto_vacuum=INCREMENTAL mode to the
+    file system, `step` pages per statement. Returns the number of released pages;
+    0 for other databases and modes (PostgreSQL's autovacuum does this itself)."""
+    if engine.dialect.name != 'sqlite':
+        return 0
+    async with engine.connect() as conn:
+        if await conn.scalar(text("PRAGMA auto_vacuum")) != 2:  # 2 = INCREMENTAL
+            return 0
+        initial = free = await conn.scalar(text("PRAGMA freelist_count"))
+        # execute() делает один шаг оператора и освобождает одну страницу, executescript() - все
+        raw = await conn.get_raw_connection()
+        while free:
+            await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({step})")
+            remaining = await conn.scalar(text("PRAGMA freelist_count"))
+            if remaining >= free:
+                break
+            free = remaining
+            await asyncio.sleep(pause)
+    return initial - free
+
+# Conversation state functions
+async def load_conversation_states() -> list[ConversationStateRow]:
+    """Get all conversation states that have not expired yet."""
+    async with new_session() as session:
+        result = await session.execute(
+            select(ConversationStateRow).where(ConversationStateRow.expires_at > datetime.utcnow())
+        )
+        return list(result.scalars().all())
+
+async def save_conversation_state(user_id: int, kind: str, topic: Optional[str], expires_at: datetime) -> None:
+    """Create or replace the conversation state of a user."""
+    async with new_session() as session:
+        await session.merge(ConversationStateRow(user_id=user_id, kind=kind, topic=topic, expires_at=expires_at))
+        await session.commit()
+
+async def delete_conversation_state(user_id: int) -> None:
+    async with new_session() as session:
+        await session.execute(delete(ConversationStateRow).where(ConversationStateRow.user_id == user_id))
+        await session.commit()
+
+async def delete_expired_conversation_states() -> int:
+    """Delete expired conversation states. Returns the number of deleted rows."""
+    async with new_session() as session:
+        result = await session.execute(
+            delete(ConversationStateRow).where(ConversationStateRow.expires_at <= datetime.utcnow())
+        )
+        await session.commit()
+        return result.rowcount
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Iterable, Optional
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: около 30 сообщений в секунду всего и 1 в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+MAX_CONCURRENCY = 20
+MAX_RETRIES = 3
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Return the flood-control wait of a RetryAfter error in seconds."""
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self) -> bool:
+        """True if the bucket is full again and can be dropped."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+    def block(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (used for flood-control waits)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DispatchStats:
+    """Counters of one dispatch run."""
+
+    def __init__(self):
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+        self.retried = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Sent messages per second."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"sent={self.sent} skipped={self.skipped} failed={self.failed} "
+                f"retried={self.retried} elapsed={self.elapsed:.2f}s rate={self.rate:.1f} msg/s")
+
+
+class MessageDispatcher:
+    """Sends messages with bounded concurrency under global and per-chat rate limits.
+
+    `send(item)` must return True if a message was sent and False if the item was skipped.
+    RetryAfter raised by `send` pauses the whole dispatcher and the item is retried.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._chat_buckets: dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        for chat_id in [c for c, b in self._chat_buckets.items() if b.is_idle()]:
+            del self._chat_buckets[chat_id]
+
+    async def _send_one(self, item, chat_id: int, send: Callable, stats: DispatchStats) -> None:
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                if await send(item):
+                    stats.sent += 1
+                else:
+                    stats.skipped += 1
+                return
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.warning(f"Flood control for chat {chat_id}: waiting {delay:.0f}s "
+                               f"(attempt {attempt + 1})")
+                self.global_bucket.block(delay)
+                stats.retried += 1
+            except Exception as e:
+                logger.error(f"Error sending message to chat {chat_id}: {e}", exc_info=True)
+                stats.failed += 1
+                return
+        stats.failed += 1
+
+    async def dispatch(self, items: Iterable, send: Callable[..., Awaitable[bool]],
+                       key: Callable[..., int] = lambda item: item) -> DispatchStats:
+        """Send every item through `send`; `key(item)` gives the chat ID for rate limiting."""
+        stats = DispatchStats()
+        items = iter(items)
+
+        async def worker():
+            # Все воркеры читают из одного итератора, поэтому задач не больше max_concurrency
+            for item in items:
+                await self._send_one(item, key(item), send, stats)
+
+        await asyncio.gather(*(worker() for _ in range(self.max_concurrency)))
+        stats.finished = time.monotonic()
+        self._prune_chat_buckets()
+        return stats
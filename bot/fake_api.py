@@ -0,0 +1,70 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {
+    'id': 1000000,
+    'is_bot': True,
+    'first_name': 'Load Test Bot',
+    'username': 'load_test_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+
+class FakeBotAPI(BaseRequest):
+    """Stand-in for the Telegram Bot API transport that records calls instead of sending them.
+
+    Pass it to ApplicationBuilder.request(); every API method succeeds after `latency`
+    seconds. Messages get sequential IDs, other methods return True.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.sent_messages = 0
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, parameters: dict) -> dict:
+        chat_id = int(parameters.get('chat_id', 0))
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': parameters.get('text', ''),
+        }
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText'):
+            self.sent_messages += 1
+            result = self._message(parameters)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
@@ -0,0 +1,207 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Awaitable, Callable, Iterable, Optional
+
+from sortedcontainers import SortedList
+
+# Окна рейтинга: название -> число дней (None - за всё время)
+WINDOWS = {'all': None, '7d': 7, '30d': 30}
+ALL_INTERESTS = 0
+
+
+class Ranking:
+    """Users ordered by score; updates and rank lookups are O(log n)."""
+
+    def __init__(self):
+        self.scores: dict[int, int] = {}
+        self._order = SortedList()  # (-score, user_id)
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def set(self, user_id: int, score: int) -> None:
+        """Set a user's score; a score of 0 removes the user."""
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            self._order.remove((-old, user_id))
+        if score > 0:
+            self.scores[user_id] = score
+            self._order.add((-score, user_id))
+
+    def top(self, n: int) -> list[tuple[int, int]]:
+        """(user_id, score) of the first n users."""
+        return [(user_id, -score) for score, user_id in self._order.islice(0, n)]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based place of the user, None if they are not ranked."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self._order.index((-score, user_id)) + 1
+
+
+class Leaderboards:
+    """Study-time rankings for every window in WINDOWS, overall and per interest.
+
+    Scores change incrementally: add_entry() for new study progress, set_mask() when
+    interests change, expire() when days leave the 7/30-day windows. Windows are rolling
+    by UTC day: "7d" is today and the 6 days before it.
+    """
+
+    def __init__(self):
+        self._rankings: dict[tuple[str, int], Ranking] = {}
+        self._masks: dict[int, int] = {}
+        self._daily: dict[date, Counter] = {}  # Минуты по дням за самое длинное окно
+        self._today = date.min
+        self.last_entry_id = 0
+
+    def ranking(self, window: str, interest_id: int = ALL_INTERESTS) -> Ranking:
+        key = (window, interest_id)
+        ranking = self._rankings.get(key)
+        if ranking is None:
+            ranking = self._rankings[key] = Ranking()
+        return ranking
+
+    def _set_score(self, window: str, user_id: int, score: int) -> None:
+        self.ranking(window).set(user_id, score)
+        for interest_id in _interest_ids(self._masks.get(user_id, 0)):
+            self.ranking(window, interest_id).set(user_id, score)
+
+    def _add_score(self, window: str, user_id: int, delta: int) -> None:
+        self._set_score(window, user_id, self.ranking(window).scores.get(user_id, 0) + delta)
+
+    def build(self, today: date, masks: Iterable, totals: Iterable, daily: Iterable, last_entry_id: int) -> None:
+        """Fill empty boards from (user_id, mask), (user_id, total_minutes) and
+        (user_id, day, minutes) rows; `daily` should cover the longest window."""
+        self._today = today
+        self.last_entry_id = last_entry_id
+        self._masks.update((user_id, mask) for user_id, mask in masks if mask)
+        for user_id, minutes in totals:
+            self._set_score('all', user_id, minutes)
+        for user_id, day, minutes in daily:
+            if today - day < timedelta(days=_longest_window()):
+                self._daily.setdefault(day, Counter())[user_id] += minutes
+        for window, days in WINDOWS.items():
+            if days is None:
+                continue
+            window_scores = Counter()
+            for day, minutes_by_user in self._daily.items():
+                if today - day < timedelta(days=days):
+                    window_scores.update(minutes_by_user)
+            for user_id, minutes in window_scores.items():
+                self._set_score(window, user_id, minutes)
+
+    def add_entry(self, user_id: int, minutes: int, day: date, entry_id: int = 0) -> None:
+        """Count a new study progress entry in every window it falls into."""
+        if entry_id and entry_id <= self.last_entry_id:
+            return  # Уже учтена при построении
+        self.last_entry_id = max(self.last_entry_id, entry_id)
+        if day > self._today:
+            self.expire(day)
+        self._add_score('all', user_id, minutes)
+        if self._today - day < timedelta(days=_longest_window()):
+            self._daily.setdefault(day, Counter())[user_id] += minutes
+        for window, days in WINDOWS.items():
+            if days is not None and self._today - day < timedelta(days=days):
+                self._add_score(window, user_id, minutes)
+
+    def set_mask(self, user_id: int, mask: int) -> None:
+        """Move a user between per-interest boards after their interests change."""
+        old_mask = self._masks.get(user_id, 0)
+        for window in WINDOWS:
+            score = self.ranking(window).scores.get(user_id, 0)
+            for interest_id in _interest_ids(old_mask & ~mask):
+                self.ranking(window, interest_id).set(user_id, 0)
+            for interest_id in _interest_ids(mask & ~old_mask):
+                self.ranking(window, interest_id).set(user_id, score)
+        if mask:
+            self._masks[user_id] = mask
+        else:
+            self._masks.pop(user_id, None)
+
+    def expire(self, today: date) -> None:
+        """Move the windows to `today`, subtracting the days that left them."""
+        if today <= self._today:
+            return
+        old_today, self._today = self._today, today
+        for window, days in WINDOWS.items():
+            if days is None:
+                continue
+            for day, minutes_by_user in self._daily.items():
+                # День был в окне вчера, но уже не в окне сегодня
+                if old_today - day < timedelta(days=days) <= today - day:
+                    for user_id, minutes in minutes_by_user.items():
+                        self._add_score(window, user_id, -minutes)
+        for day in [d for d in self._daily if today - d >= timedelta(days=_longest_window())]:
+            del self._daily[day]
+
+    def top(self, window: str, interest_id: int = ALL_INTERESTS, n: int = 10) -> list[tuple[int, int]]:
+        return self.ranking(window, interest_id).top(n)
+
+    def rank(self, user_id: int, window: str, interest_id: int = ALL_INTERESTS) -> tuple[Optional[int], int]:
+        """(place of the user or None, number of ranked users) on one board."""
+        ranking = self.ranking(window, interest_id)
+        return ranking.rank(user_id), len(ranking)
+
+
+def _longest_window() -> int:
+    return max(days for days in WINDOWS.values() if days is not None)
+
+
+def _interest_ids(mask: int) -> list[int]:
+    """Catalog IDs (bit position + 1) of the interests in a mask."""
+    ids = []
+    while mask:
+        low_bit = mask & -mask
+        ids.append(low_bit.bit_length())
+        mask ^= low_bit
+    return ids
+
+
+class LeaderboardStore:
+    """Current Leaderboards plus their background rebuild.
+
+    on_study()/on_interests() are database listeners. Events that arrive while rebuild()
+    waits for the database are replayed on the new boards before they replace the old ones.
+    """
+
+    def __init__(self, load: Callable[[datetime], Awaitable]):
+        self.boards = Leaderboards()
+        self._load = load
+        self._pending: Optional[list[tuple]] = None
+
+    def on_study(self, user_id: int, progress) -> None:
+        event = ('study', user_id, progress.study_time_minutes, progress.date.date(), progress.id)
+        self._apply(self.boards, event)
+        if self._pending is not None:
+            self._pending.append(event)
+
+    def on_interests(self, user_id: int, mask: int) -> None:
+        event = ('interests', user_id, mask)
+        self._apply(self.boards, event)
+        if self._pending is not None:
+            self._pending.append(event)
+
+    @staticmethod
+    def _apply(boards: Leaderboards, event: tuple) -> None:
+        if event[0] == 'study':
+            boards.add_entry(*event[1:])
+        else:
+            boards.set_mask(*event[1:])
+
+    async def rebuild(self) -> None:
+        """Recompute all boards from the database and swap them in."""
+        today = datetime.utcnow().date()
+        self._pending = []
+        try:
+            data = await self._load(datetime.combine(today - timedelta(days=_longest_window() - 1), time.min))
+            boards = Leaderboards()
+            boards.build(today, data.masks, data.totals, data.daily, data.last_entry_id)
+            for event in self._pending:
+                self._apply(boards, event)
+            self.boards = boards
+        finally:
+            self._pending = None
+
+    def expire(self) -> None:
+        self.boards.expire(datetime.utcnow().date())
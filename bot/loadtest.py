@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from telegram import Update
+
+# Первый синтетический пользователь; ID не пересекаются с реальными
+FIRST_USER_ID = 900_000_000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Drive the bot with synthetic updates against a fake Bot API and a scratch database"
+    )
+    parser.add_argument('--users', type=int, default=200, help="number of simulated users")
+    parser.add_argument('--db', default='loadtest.db', help="scratch SQLite file (recreated on every run)")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="simulated Bot API round-trip time")
+    parser.add_argument('--send-rate', type=float, default=30, help="reminder dispatcher rate limit, msg/s")
+    parser.add_argument('--concurrency', type=int, default=None, help="BOT_CONCURRENT_UPDATES for the run")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Update JSON for a private text message (commands get a bot_command entity)."""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """Update JSON for an inline button press."""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                        'text': "menu"},
+        },
+    }
+
+
+def conversation(user_id: int, rng: random.Random) -> list[tuple[str, str]]:
+    """Registration and settings session of one user as (kind, payload) steps."""
+    interests = rng.sample(range(1, 9), rng.randint(1, 4))
+    return [
+        ('message', '/start'),
+        ('message', '/interests'),
+        ('message', ','.join(map(str, interests))),
+        ('message', '/reminder'),
+        ('message', str(rng.randint(1, 7))),
+        ('message', '/config'),
+        ('callback', 'help'),
+        ('callback', 'config'),
+        ('message', "просто текст"),
+    ]
+
+
+def reminder_answer(user_id: int, rng: random.Random) -> list[tuple[str, str]]:
+    """Answer to a reminder: topic, then minutes."""
+    return [
+        ('message', rng.choice(["Алгебра", "Python", "История Рима", "Органическая химия"])),
+        ('message', str(rng.randint(10, 180))),
+    ]
+
+
+class PhaseStats:
+    """Latencies and counters of one load test phase."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.db_statements = 0
+        self.api_calls = 0
+
+    def report(self) -> str:
+        from metrics import percentile
+        values = sorted(self.latencies)
+        count = len(values)
+        rate = count / self.elapsed if self.elapsed else 0
+        return (
+            f"{self.name}: {count} updates in {self.elapsed:.2f}s ({rate:.0f} updates/s)\n"
+            f"  latency p50/p95/p99/max: {percentile(values, 0.5) * 1000:.1f}/"
+            f"{percentile(values, 0.95) * 1000:.1f}/{percentile(values, 0.99) * 1000:.1f}/"
+            f"{(values[-1] if values else 0) * 1000:.1f} ms\n"
+            f"  SQL statements: {self.db_statements} ({self.db_statements / (count or 1):.1f}/update), "
+            f"Bot API calls: {self.api_calls}"
+        )
+
+
+async def run(args: argparse.Namespace) -> None:
+    # База и настройки должны быть заданы до импорта модулей бота
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['BOT_DATABASE_URL'] = f"sqlite+aiosqlite:///{args.db}"
+    os.environ['BOT_METRICS_FILE'] = ''
+    if args.concurrency:
+        os.environ['BOT_CONCURRENT_UPDATES'] = str(args.concurrency)
+
+    import main as bot
+    from database import new_session, UserReminder
+    from dispatcher import MessageDispatcher
+    from fake_api import FakeBotAPI
+    from metrics import metrics
+    from sqlalchemy import update as sql_update
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    api = FakeBotAPI(latency=args.api_latency_ms / 1000)
+    app = bot.build_application('123456:loadtest', request=api)
+    bot.outbox_dispatcher = MessageDispatcher(global_rate=args.send_rate)
+    update_ids = iter(range(1, 10 ** 9))
+
+    await app.initialize()
+    await bot.post_init_handler(app)
+    # Рассылку в фазе reminder storm выполняет drain(), без фонового воркера
+    app.bot_data.pop('outbox_task').cancel()
+
+    async def process(payload: dict, stats: PhaseStats) -> None:
+        update = Update.de_json(payload, app.bot)
+        started = time.perf_counter()
+        # Так же, как Application: через процессор с его ограничениями параллельности
+        await app.update_processor.process_update(update, app.process_update(update))
+        stats.latencies.append(time.perf_counter() - started)
+
+    async def user_session(user_id: int, steps: list[tuple[str, str]], stats: PhaseStats) -> None:
+        for kind, payload in steps:
+            if kind == 'callback':
+                await process(callback_update(next(update_ids), user_id, payload), stats)
+            else:
+                await process(message_update(next(update_ids), user_id, payload), stats)
+
+    async def run_phase(name: str, make_steps) -> PhaseStats:
+        stats = PhaseStats(name)
+        statements, api_calls = metrics.db_statements, sum(api.calls.values())
+        user_ids = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+        await asyncio.gather(*(user_session(user_id, make_steps(user_id, rng), stats) for user_id in user_ids))
+        stats.elapsed = time.perf_counter() - stats.started
+        stats.db_statements = metrics.db_statements - statements
+        stats.api_calls = sum(api.calls.values()) - api_calls
+        return stats
+
+    try:
+        print(f"Load test: {args.users} users, Bot API latency {args.api_latency_ms:.0f} ms, "
+              f"scratch database {args.db}\n")
+        print((await run_phase("conversations", conversation)).report())
+
+        # Reminder storm: все напоминания становятся просроченными одновременно
+        async with new_session() as session:
+            await session.execute(
+                sql_update(UserReminder).values(next_reminder_date=datetime.utcnow() - timedelta(minutes=1))
+            )
+            await session.commit()
+        statements, sent_before = metrics.db_statements, api.sent_messages
+        started = time.perf_counter()
+        await bot.send_due_reminders(app)
+        await app.bot_data['outbox_worker'].drain()
+        elapsed = time.perf_counter() - started
+        sent = api.sent_messages - sent_before
+        print(f"reminder storm: {sent} reminders in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.0f} msg/s, "
+              f"limit {args.send_rate:.0f} msg/s), SQL statements: {metrics.db_statements - statements}")
+
+        print((await run_phase("reminder answers", reminder_answer)).report())
+        print(f"\nBot API calls: {dict(api.calls)}")
+    finally:
+        for task in app.bot_data.values():
+            if isinstance(task, asyncio.Task):
+                task.cancel()
+        # Как Application.stop(): post_stop дописывает буферизованные записи до shutdown
+        await bot.post_stop_handler(app)
+        await app.shutdown()
+
+
+def main() -> None:
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# extra= для частых INFO-строк (по одной на апдейт или на напоминание): они проходят выборочно
+SAMPLED = {'sampled': True}
+# Логгеры библиотек, все INFO-строки которых считаются частыми (httpx - строка на каждый запрос к API)
+SAMPLED_LOGGERS = ('httpx',)
+
+# Апдейт, который сейчас обрабатывается в этой задаче: (update_id, user_id)
+update_context: contextvars.ContextVar[Optional[tuple[Optional[int], Optional[int]]]] = contextvars.ContextVar(
+    'log_update_context', default=None
+)
+
+
+class UpdateContextFilter(logging.Filter):
+    """Adds update_id and user_id of the update being handled to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = update_context.get()
+        record.update_id, record.user_id = context if context else (None, None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only `rate` of the high-volume INFO records (see SAMPLED); other records always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if getattr(record, 'sampled', False) or record.name.startswith(SAMPLED_LOGGERS):
+            return random.random() < self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the update context and handler latency when present."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in ('update_id', 'user_id', 'handler', 'latency_ms'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener's handlers.
+
+    The stock prepare() renders the record with this handler's formatter, traceback
+    included, into `msg`; here only the arguments are merged and the traceback is kept
+    in exc_text, so JsonFormatter still gets the plain message and the extra fields.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None  # Трейсбек уже в exc_text, сам объект в очередь не кладём
+        return record
+
+
+def _file_handler(path: str) -> logging.Handler:
+    rotate = os.getenv('BOT_LOG_ROTATE', 'size')
+    backups = int(os.getenv('BOT_LOG_BACKUPS', '5'))
+    if rotate == 'size':
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=int(float(os.getenv('BOT_LOG_MAX_MB', '10')) * 1024 * 1024),
+            backupCount=backups, encoding='utf-8'
+        )
+    # Любое другое значение - интервал TimedRotatingFileHandler: midnight, H, D, W0...
+    return logging.handlers.TimedRotatingFileHandler(path, when=rotate, backupCount=backups, encoding='utf-8', utc=True)
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a background thread writing the console and the file.
+
+    Settings (environment): BOT_LOG_LEVEL, BOT_LOG_FILE (empty - console only),
+    BOT_LOG_ROTATE (size or a TimedRotatingFileHandler interval), BOT_LOG_MAX_MB,
+    BOT_LOG_BACKUPS, BOT_LOG_FORMAT (text or json, file only) and BOT_LOG_SAMPLE_RATE.
+    """
+    formatter = JsonFormatter() if os.getenv('BOT_LOG_FORMAT', 'text') == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers: list[logging.Handler] = [logging.StreamHandler()]
+    handlers[0].setFormatter(logging.Formatter(TEXT_FORMAT))
+    log_file = os.getenv('BOT_LOG_FILE', 'bot.log')
+    if log_file:
+        file_handler = _file_handler(log_file)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(float(os.getenv('BOT_LOG_SAMPLE_RATE', '1.0'))))
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv('BOT_LOG_LEVEL', 'INFO').upper())
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Дописать очередь в файл при выходе
+    return listener
@@ -2,65 +2,77 @@ import os
 import logging
 import asyncio
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from telegram import Update
+from telegram.request import BaseRequest
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, TypeHandler, filters
 from dotenv import load_dotenv
 from database import (
     init_db, get_user_by_telegram_id, create_user, get_user_interests, save_user_interests,
-    get_user_reminder, create_or_update_reminder, update_reminder_date, get_users_due_for_reminder,
-    save_study_progress, get_user_study_stats
+    get_user_reminder, create_or_update_reminder, advance_reminder_date, get_due_reminders, iter_due_reminders,
+    queue_reminders, get_outbox_counts, add_reminder_listener, write_buffer, add_interests_listener, add_study_listener,
+    get_match_rows, get_users_by_telegram_ids, mask_to_interests, get_leaderboard_data, interest_names,
+    save_study_progress, get_study_totals, compact_study_progress, vacuum_free_pages, engine, get_cache_stats, get_pool_status
+)
+from messages import INTERESTS_LIST, format_interests_list
+from rendering import (
+    DEFAULT_LOCALE, get_locale, get_cached_user_config, render_user_config, invalidate_user_config
+)
+from dispatcher import MessageDispatcher
+from outbox import OutboxWorker
+from scheduler import ReminderScheduler
+from matching import MatchIndex
+from leaderboard import LeaderboardStore, WINDOWS, ALL_INTERESTS
+from update_processor import PerUserUpdateProcessor
+from metrics import metrics, instrument, install_engine_events, write_prometheus_file_task
+from traffic import TrafficRecorder
+from logging_setup import setup_logging, SAMPLED
+from state import (
+    ConversationState, create_state_store,
+    WAITING_INTERESTS, WAITING_REMINDER_INTERVAL, WAITING_PROGRESS_TOPIC, WAITING_PROGRESS_TIME
 )
-from messages import INTERESTS_LIST, format_interests_list, format_available_interests
 
 load_dotenv()
 
-# Enable logging to both console and file
-log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(
-    format=log_format,
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Console and file logging from a background thread, handlers only enqueue records
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Telegram IDs allowed to use /stats
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('BOT_ADMIN_IDS', '').split(',') if admin_id.strip()}
 
-def format_user_config(db_user, interests: list[str]) -> str:
-    """Format user configuration information."""
-    config_text = "⚙️ **Ваши настройки:**\n\n"
-    config_text += f"**ID пользователя:** {db_user.id}\n"
-    config_text += f"**Telegram ID:** {db_user.telegram_id}\n"
-    config_text += f"**Имя:** {db_user.first_name or 'Не указано'}\n"
-    config_text += f"**Фамилия:** {db_user.last_name or 'Не указано'}\n"
-    config_text += f"**Username:** @{db_user.username if db_user.username else 'Не указано'}\n"
-    config_text += f"**Статус:** {'Активен' if db_user.is_active else 'Неактивен'}\n\n"
-    
-    config_text += "**Ваши интересы:**\n"
-    if interests:
-        for i, interest in enumerate(interests, 1):
-            config_text += f"{i}. {interest}\n"
-    else:
-        config_text += "Интересы не выбраны. Используйте /interests для выбора.\n"
-    
-    return config_text
+# Count SQL statements and DB time per handler
+install_engine_events(engine)
+
+# Due reminders read and queued per page, so a large backlog is handled in bounded memory
+REMINDER_PAGE_SIZE = 1000
+
+# Users by interests for /match, built in post_init_handler
+match_index = MatchIndex()
+MATCH_COUNT = 5
+
+# Study-time rankings for /top, updated on every saved progress and rebuilt in the background
+leaderboards = LeaderboardStore(get_leaderboard_data)
+TOP_COUNT = 10
+LEADERBOARD_REBUILD_INTERVAL = timedelta(hours=6)
+
+# Study progress older than this is folded into monthly summaries once a day; 0 keeps every entry
+STUDY_RETENTION_DAYS = int(os.getenv('BOT_STUDY_RETENTION_DAYS', '180'))
+COMPACTION_INTERVAL = timedelta(days=1)
+
+# Conversation states; BOT_STATE_BACKEND=memory keeps them only until restart
+conversation_states = create_state_store(os.getenv('BOT_STATE_BACKEND', 'sqlite'))
 
 
 def get_main_keyboard():
-    """Create main keyboard with Help and Config buttons"""
-    keyboard = [
-        [
-            InlineKeyboardButton("📖 Помощь", callback_data="help"),
-            InlineKeyboardButton("⚙️ Настройки", callback_data="config")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    """Main keyboard with Help and Config buttons (built once, see rendering.py)"""
+    return DEFAULT_LOCALE.main_keyboard
 
 
+@instrument
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.message.from_user
+    locale = get_locale(user)
     
     try:
         # Adding new user to database or updating existing one
@@ -78,13 +90,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             is_new_user = True
         
         if is_new_user:
-            welcome_text = f"""🎉 Добро пожаловать, {user.first_name or 'друг'}!
-
-Я дейлик бот - помогу тебе найти единомышленников и интересные темы для обсуждения.
-
-**Для начала работы нужно выбрать интересы!**
-
-Это поможет мне лучше понять, чем ты увлекаешься. 👇"""
+            welcome_text = locale.welcome(user.first_name, is_new_user=True, has_interests=False)
             
             await update.message.reply_text(
                 welcome_text,
@@ -97,10 +103,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         else:
             # Проверяем, есть ли интересы у пользователя
             interests = await get_user_interests(db_user.id)
+            welcome_text = locale.welcome(user.first_name, is_new_user=False, has_interests=bool(interests))
             if not interests:
-                welcome_text = f"""👋 С возвращением, {user.first_name or 'друг'}!
-
-Похоже, ты еще не выбрал свои интересы. Давай это исправим! 👇"""
                 await update.message.reply_text(
                     welcome_text,
                     reply_markup=get_main_keyboard()
@@ -108,13 +112,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 await asyncio.sleep(1)
                 await show_interests_selection(update, context, db_user)
             else:
-                welcome_text = f"""👋 С возвращением, {user.first_name or 'друг'}!
-
-Используй команды для навигации:
-/help - Справка по командам
-/config - Настройки профиля  
-/interests - Управление интересами
-/reminder - Настройка напоминаний"""
                 await update.message.reply_text(
                     welcome_text,
                     reply_markup=get_main_keyboard()
@@ -129,74 +126,27 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def show_interests_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user) -> None:
     """Show interests selection interface."""
-    from messages import format_available_interests
-    message_text = "🎯 **Выбор интересов**\n\n"
-    message_text += format_available_interests()
-    message_text += "\n\n💡 **Инструкция:**\nОтправьте команду с номерами интересов через запятую.\nПример: `/interests 1,3,5`"
-    
     await update.message.reply_text(
-        message_text,
+        get_locale(update.message.from_user).interests_selection,
         parse_mode='Markdown',
         reply_markup=get_main_keyboard()
     )
 
 
+@instrument
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
-    help_text = """📖 **Справка по командам**
-
-**Основные команды:**
-
-/start - Начать работу с ботом
-Зарегистрирует вас в системе и покажет приветственное сообщение
-
-/help - Показать эту справку
-Отображает список всех доступных команд
-
-/config - Показать настройки профиля
-Показывает ваши данные и выбранные интересы
-
-/interests - Управление интересами
-Позволяет выбрать или изменить ваши интересы
-
-/reminder - Настройка напоминаний
-Настрой интервал напоминаний о прогрессе (1-7 дней)
-
-**Как использовать:**
-
-1. Начните с команды /start для регистрации
-2. Используйте /interests для выбора ваших интересов
-3. Настройте напоминания через /reminder
-4. Просматривайте свой профиль через /config
-
-**Примеры:**
-
-Выбор интересов:
-`/interests 1,3,5`
-
-Настройка напоминаний:
-`/reminder 3` - напоминать каждые 3 дня
-
-**О напоминаниях:**
-
-Бот будет автоматически напоминать тебе о твоем прогрессе. Когда придет напоминание, просто ответь на вопросы:
-- Что ты изучал?
-- Сколько времени потратил?
-
-Бот сохранит твой прогресс и подбодрит тебя! 💪
-
-Также используйте кнопки ниже для быстрого доступа! 👇"""
-    
     await update.message.reply_text(
-        help_text,
+        get_locale(update.message.from_user).help_text,
         parse_mode='Markdown',
         reply_markup=get_main_keyboard()
     )
 
 
+@instrument
 async def config_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show user configuration and information."""
-    error_msg, config_text = await get_user_config_text(update.message.from_user.id)
+    error_msg, config_text = await get_user_config_text(update.message.from_user)
     if error_msg:
         await update.message.reply_text(
             error_msg,
@@ -210,73 +160,41 @@ async def config_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
 
 
-async def get_user_config_text(user_id: int) -> tuple[str | None, str]:
+async def get_user_config_text(user) -> tuple[str | None, str]:
     """Get user configuration text. Returns (error_message, config_text)."""
-    db_user = await get_user_by_telegram_id(user_id)
+    db_user = await get_user_by_telegram_id(user.id)
     if not db_user:
         return "Пожалуйста, сначала используйте команду /start", ""
     
-    interests = await get_user_interests(db_user.id)
-    config_text = format_user_config(db_user, interests)
+    locale = get_locale(user)
+    config_text = get_cached_user_config(locale, db_user.id)
+    if config_text is None:
+        interests = await get_user_interests(db_user.id)
+        config_text = render_user_config(locale, db_user, interests)
     return None, config_text
 
 
+@instrument
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button callbacks."""
     query = update.callback_query
     await query.answer()
     
     if query.data == "help":
-        help_text = """📖 **Справка по командам**
-
-**Основные команды:**
-
-/start - Начать работу с ботом
-Зарегистрирует вас в системе и покажет приветственное сообщение
-
-/help - Показать эту справку
-Отображает список всех доступных команд
-
-/config - Показать настройки профиля
-Показывает ваши данные и выбранные интересы
-
-/interests - Управление интересами
-Позволяет выбрать или изменить ваши интересы
-
-/reminder - Настройка напоминаний
-Настрой интервал напоминаний о прогрессе (1-7 дней)
-
-**Как использовать:**
-
-1. Начните с команды /start для регистрации
-2. Используйте /interests для выбора ваших интересов
-3. Настройте напоминания через /reminder
-4. Просматривайте свой профиль через /config
-
-**Примеры:**
-
-Выбор интересов:
-`/interests 1,3,5`
-
-Настройка напоминаний:
-`/reminder 3` - напоминать каждые 3 дня
-
-**О напоминаниях:**
-
-Бот будет автоматически напоминать тебе о твоем прогрессе. Когда придет напоминание, просто ответь на вопросы:
-- Что ты изучал?
-- Сколько времени потратил?
-
-Бот сохранит твой прогресс и подбодрит тебя! 💪
-
-Также используйте кнопки ниже для быстрого доступа! 👇"""
         await query.edit_message_text(
-            text=help_text,
+            text=get_locale(query.from_user).help_text,
             parse_mode='Markdown',
             reply_markup=get_main_keyboard()
         )
+    elif query.data.startswith("top:"):
+        _, window, interest_id = query.data.split(":")
+        if window in WINDOWS:
+            await query.edit_message_text(
+                text=await render_leaderboard(query.from_user, window, int(interest_id)),
+                reply_markup=get_locale(query.from_user).top_keyboard(int(interest_id))
+            )
     elif query.data == "config":
-        error_msg, config_text = await get_user_config_text(query.from_user.id)
+        error_msg, config_text = await get_user_config_text(query.from_user)
         if error_msg:
             await query.edit_message_text(
                 text=error_msg,
@@ -290,6 +208,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
 
 
+@instrument
 async def users_interests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /interests is issued."""
     user = update.message.from_user
@@ -312,17 +231,10 @@ async def users_interests(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Asking user to select their interests - set waiting state
         current_interests = await get_user_interests(db_user.id)
-        
-        message_text = "🎯 **Выбор интересов**\n\n"
-        if current_interests:
-            message_text += f"Текущие интересы:\n{format_interests_list(current_interests)}\n"
-            message_text += "─" * 20 + "\n\n"
-        
-        message_text += format_available_interests()
-        message_text += "\n\n💡 **Инструкция:**\nОтправьте номера интересов через запятую в следующем сообщении.\n**Пример:** `1,3,5`"
+        message_text = get_locale(user).interests_prompt(current_interests)
         
         # Set user as waiting for interests input
-        user_waiting_for_interests[user.id] = True
+        await conversation_states.set(user.id, WAITING_INTERESTS)
         
         await update.message.reply_text(
             message_text,
@@ -332,8 +244,7 @@ async def users_interests(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
     except Exception as e:
         logger.error(f"Error in users_interests command: {e}", exc_info=True)
-        if user.id in user_waiting_for_interests:
-            del user_waiting_for_interests[user.id]
+        await conversation_states.clear(user.id, WAITING_INTERESTS)
         await update.message.reply_text(
             "❌ Произошла ошибка. Попробуйте позже.",
             reply_markup=get_main_keyboard()
@@ -362,29 +273,26 @@ async def process_interests_input(user_id: int, interests_str: str, db_user, upd
         
         if selected_interests:
             # Saving user interests to database
-            logger.info(f"Saving interests for user {db_user.id}: {selected_interests}")
-            success = await save_user_interests(db_user.id, selected_interests)
+            logger.info(f"Saving interests for user {db_user.id}: {selected_interests}", extra=SAMPLED)
+            change = await save_user_interests(db_user.id, selected_interests)
             
-            if success:
-                # Verify that interests were saved
-                saved_interests = await get_user_interests(db_user.id)
-                logger.info(f"Interests saved. Retrieved from DB: {saved_interests}")
+            if change is not None:
+                logger.info(f"Interests saved for user {db_user.id}: added {change.added}, removed {change.removed}",
+                            extra=SAMPLED)
+                invalidate_user_config(db_user.id)
+                
+                # Clear waiting state
+                await conversation_states.clear(user_id, WAITING_INTERESTS)
                 
-                if saved_interests:
-                    # Clear waiting state
-                    if user_id in user_waiting_for_interests:
-                        del user_waiting_for_interests[user_id]
-                    
-                    await update.message.reply_text(
-                        "✅ Ваши интересы успешно сохранены!",
-                        reply_markup=get_main_keyboard()
-                    )
-                    await update.message.reply_text(format_interests_list(saved_interests))
+                if change.added or change.removed:
+                    confirmation = "✅ Ваши интересы успешно сохранены!"
                 else:
-                    await update.message.reply_text(
-                        "⚠️ Произошла ошибка при сохранении. Попробуйте еще раз.\n"
-                        "Используйте /interests для повторной попытки."
-                    )
+                    confirmation = "✅ Интересы не изменились."
+                await update.message.reply_text(
+                    confirmation,
+                    reply_markup=get_main_keyboard()
+                )
+                await update.message.reply_text(format_interests_list(change.interests))
             else:
                 await update.message.reply_text(
                     "❌ Ошибка при сохранении интересов. Попробуйте позже.\n"
@@ -404,7 +312,81 @@ async def process_interests_input(user_id: int, interests_str: str, db_user, upd
         )
 
 
+@instrument
+async def match_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show users with the most similar interests."""
+    user = update.message.from_user
+    locale = get_locale(user)
+    
+    try:
+        db_user = await get_user_by_telegram_id(user.id)
+        if not db_user:
+            await update.message.reply_text(
+                "Пожалуйста, сначала используйте команду /start для регистрации",
+                reply_markup=get_main_keyboard()
+            )
+            return
+        if not db_user.interests_mask:
+            await update.message.reply_text(locale.texts.MATCH_NO_INTERESTS, reply_markup=get_main_keyboard())
+            return
+        
+        matches = match_index.top_k(user.id, k=MATCH_COUNT, mask=db_user.interests_mask)
+        users = await get_users_by_telegram_ids(m.user_id for m in matches)
+        rows = [
+            (users[m.user_id].first_name, users[m.user_id].username, m.similarity, mask_to_interests(m.common_mask))
+            for m in matches if m.user_id in users
+        ]
+        await update.message.reply_text(
+            locale.matches(rows) if rows else locale.texts.MATCH_NOT_FOUND,
+            reply_markup=get_main_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Error in match command: {e}", exc_info=True)
+        await update.message.reply_text(
+            "❌ Произошла ошибка. Попробуйте позже.",
+            reply_markup=get_main_keyboard()
+        )
+
+
+async def render_leaderboard(user, window: str, interest_id: int) -> str:
+    """Text of one /top board with the user's own place."""
+    locale = get_locale(user)
+    boards = leaderboards.boards
+    top = boards.top(window, interest_id, TOP_COUNT)
+    users = await get_users_by_telegram_ids(user_id for user_id, _ in top)
+    rows = [(users[user_id].first_name if user_id in users else None, minutes) for user_id, minutes in top]
+    place, total = boards.rank(user.id, window, interest_id)
+    return locale.leaderboard(window, interest_names.get(interest_id), rows, place, total)
+
+
+@instrument
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the study-time leaderboard, optionally among users with one interest."""
+    user = update.message.from_user
+    interest_id = ALL_INTERESTS
+    if context.args:
+        try:
+            interest_id = int(context.args[0])
+        except ValueError:
+            interest_id = -1
+        if interest_id not in interest_names:
+            await update.message.reply_text(
+                f"⚠️ Укажите номер интереса от 1 до {len(interest_names)}, например: /top 3"
+            )
+            return
+    
+    try:
+        await update.message.reply_text(
+            await render_leaderboard(user, 'all', interest_id),
+            reply_markup=get_locale(user).top_keyboard(interest_id)
+        )
+    except Exception as e:
+        logger.error(f"Error in top command: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
+
 # Reminder system
+@instrument
 async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Setup reminder settings."""
     user = update.message.from_user
@@ -457,14 +439,13 @@ async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 **Пример:** `3`"""
         
         # Set user as waiting for reminder interval input
-        user_waiting_for_reminder_interval[user.id] = True
+        await conversation_states.set(user.id, WAITING_REMINDER_INTERVAL)
         
         await update.message.reply_text(text, parse_mode='Markdown', reply_markup=get_main_keyboard())
     
     except Exception as e:
         logger.error(f"Error in reminder_command: {e}", exc_info=True)
-        if user.id in user_waiting_for_reminder_interval:
-            del user_waiting_for_reminder_interval[user.id]
+        await conversation_states.clear(user.id, WAITING_REMINDER_INTERVAL)
         await update.message.reply_text("❌ Произошла ошибка.")
 
 
@@ -481,8 +462,7 @@ async def process_reminder_interval(user_id: int, interval_days: int, db_user, u
         success = await create_or_update_reminder(db_user.id, interval_days)
         if success:
             # Clear waiting state
-            if user_id in user_waiting_for_reminder_interval:
-                del user_waiting_for_reminder_interval[user_id]
+            await conversation_states.clear(user_id, WAITING_REMINDER_INTERVAL)
             
             await update.message.reply_text(
                 f"✅ Напоминания настроены!\n"
@@ -497,251 +477,331 @@ async def process_reminder_interval(user_id: int, interval_days: int, db_user, u
             )
     except Exception as e:
         logger.error(f"Error processing reminder interval: {e}", exc_info=True)
-        if user_id in user_waiting_for_reminder_interval:
-            del user_waiting_for_reminder_interval[user_id]
+        await conversation_states.clear(user_id, WAITING_REMINDER_INTERVAL)
         await update.message.reply_text("❌ Произошла ошибка.")
 
 
-# Handler for reminder responses
-user_waiting_for_progress = {}  # {user_id: {'waiting_for': 'topic' or 'time', 'topic': ...}}
-
-# Handler for interests selection
-user_waiting_for_interests = {}  # {user_id: True} - user is waiting to enter interests
-
-# Handler for reminder interval selection
-user_waiting_for_reminder_interval = {}  # {user_id: True} - user is waiting to enter reminder interval
-
-
-async def handle_progress_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle user responses to reminder questions and interests input."""
-    user = update.message.from_user
-    user_id = user.id
-    
-    # Check if user is waiting for reminder interval input
-    if user_id in user_waiting_for_reminder_interval:
-        try:
-            db_user = await get_user_by_telegram_id(user_id)
-            if not db_user:
-                if user_id in user_waiting_for_reminder_interval:
-                    del user_waiting_for_reminder_interval[user_id]
-                return
-            
-            interval_str = update.message.text.strip()
-            try:
-                interval_days = int(interval_str)
-                await process_reminder_interval(user_id, interval_days, db_user, update)
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат. Пожалуйста, отправьте число от 1 до 7.\n"
-                    "**Пример:** `3`\n\n"
-                    "Используйте /reminder для отмены."
-                )
-            return
-        except Exception as e:
-            logger.error(f"Error handling reminder interval input: {e}", exc_info=True)
-            if user_id in user_waiting_for_reminder_interval:
-                del user_waiting_for_reminder_interval[user_id]
-            await update.message.reply_text(
-                "❌ Произошла ошибка при обработке. Попробуйте /reminder еще раз."
-            )
-            return
-    
-    # Check if user is waiting for interests input
-    if user_id in user_waiting_for_interests:
-        try:
-            db_user = await get_user_by_telegram_id(user_id)
-            if not db_user:
-                if user_id in user_waiting_for_interests:
-                    del user_waiting_for_interests[user_id]
-                return
-            
-            interests_str = update.message.text.strip()
-            await process_interests_input(user_id, interests_str, db_user, update)
-            return
-        except Exception as e:
-            logger.error(f"Error handling interests input: {e}", exc_info=True)
-            if user_id in user_waiting_for_interests:
-                del user_waiting_for_interests[user_id]
-            await update.message.reply_text(
-                "❌ Произошла ошибка при обработке. Попробуйте /interests еще раз."
-            )
-            return
-    
-    # Check if user is waiting for progress reminder
-    if user_id not in user_waiting_for_progress:
-        return
-    
+async def handle_reminder_interval_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state: ConversationState) -> None:
+    """Handle reminder interval sent after /reminder."""
+    user_id = update.message.from_user.id
     try:
         db_user = await get_user_by_telegram_id(user_id)
         if not db_user:
+            await conversation_states.clear(user_id)
             return
         
-        state = user_waiting_for_progress[user_id]
-        
-        if state.get('waiting_for') == 'topic':
-            # User provided topic
-            topic = update.message.text.strip()
-            if len(topic) > 200:
-                await update.message.reply_text("Тема слишком длинная. Пожалуйста, укажи короче (до 200 символов).")
-                return
-            
-            user_waiting_for_progress[user_id] = {
-                'waiting_for': 'time',
-                'topic': topic
-            }
+        interval_str = update.message.text.strip()
+        try:
+            interval_days = int(interval_str)
+            await process_reminder_interval(user_id, interval_days, db_user, update)
+        except ValueError:
             await update.message.reply_text(
-                f"Отлично! Ты изучал: {topic}\n\n"
-                "⏱ Сколько времени ты потратил? (в минутах)\n"
-                "Например: 30, 60, 120"
+                "❌ Неверный формат. Пожалуйста, отправьте число от 1 до 7.\n"
+                "**Пример:** `3`\n\n"
+                "Используйте /reminder для отмены."
             )
-        
-        elif state.get('waiting_for') == 'time':
-            # User provided time
-            try:
-                time_minutes = int(update.message.text.strip())
-                if time_minutes <= 0:
-                    await update.message.reply_text("Время должно быть положительным числом. Попробуй еще раз.")
-                    return
-                if time_minutes > 1440:  # 24 hours
-                    await update.message.reply_text("Это слишком много! Максимум 1440 минут (24 часа). Попробуй еще раз.")
-                    return
-                
-                topic = state.get('topic', 'Не указано')
-                
-                # Save progress
-                success = await save_study_progress(user_id, topic, time_minutes)
-                
-                if success:
-                    # Get stats
-                    stats = await get_user_study_stats(user_id)
-                    total_hours = stats['total_time_minutes'] // 60
-                    total_minutes = stats['total_time_minutes'] % 60
-                    
-                    # Motivational messages
-                    motivational_msgs = [
-                        "🎉 Отличная работа! Продолжай в том же духе!",
-                        "💪 Ты делаешь прогресс! Каждый день приближает тебя к цели!",
-                        "🌟 Превосходно! Не останавливайся!",
-                        "🚀 Ты на правильном пути! У тебя все получается!",
-                        "✨ Замечательно! Твои усилия не напрасны!",
-                    ]
-                    
-                    import random
-                    motivational = random.choice(motivational_msgs)
-                    
-                    message = f"{motivational}\n\n"
-                    message += "📊 **Твоя статистика:**\n"
-                    message += f"Тем изучено: {stats['total_topics']}\n"
-                    message += f"Общее время: {total_hours} ч {total_minutes} мин\n\n"
-                    message += f"Сегодня ты добавил: {time_minutes} мин изучения по теме '{topic}'"
-                    
-                    await update.message.reply_text(message, parse_mode='Markdown')
-                    
-                    # Update reminder date
-                    reminder = await get_user_reminder(user_id)
-                    if reminder:
-                        next_date = datetime.utcnow() + timedelta(days=reminder.reminder_interval_days)
-                        await update_reminder_date(user_id, next_date)
-                    
-                    # Clear waiting state
-                    del user_waiting_for_progress[user_id]
-                else:
-                    await update.message.reply_text("❌ Ошибка при сохранении. Попробуй еще раз.")
-                    del user_waiting_for_progress[user_id]
-            
-            except ValueError:
-                await update.message.reply_text("Пожалуйста, укажи число (в минутах). Например: 30, 60, 120")
-    
     except Exception as e:
-        logger.error(f"Error handling progress response: {e}", exc_info=True)
-        if user_id in user_waiting_for_progress:
-            del user_waiting_for_progress[user_id]
-        await update.message.reply_text("❌ Произошла ошибка.")
+        logger.error(f"Error handling reminder interval input: {e}", exc_info=True)
+        await conversation_states.clear(user_id)
+        await update.message.reply_text(
+            "❌ Произошла ошибка при обработке. Попробуйте /reminder еще раз."
+        )
 
 
-async def send_reminder_to_user(user_id: int, application: Application) -> None:
-    """Send reminder to a specific user."""
+async def handle_interests_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state: ConversationState) -> None:
+    """Handle interest numbers sent after /interests."""
+    user_id = update.message.from_user.id
     try:
-        reminder = await get_user_reminder(user_id)
-        if not reminder or not reminder.is_enabled:
-            return
-        
         db_user = await get_user_by_telegram_id(user_id)
         if not db_user:
+            await conversation_states.clear(user_id)
             return
         
-        # Set user as waiting for progress
-        user_waiting_for_progress[user_id] = {'waiting_for': 'topic'}
-        
-        message = f"👋 Привет, {db_user.first_name or 'друг'}!\n\n"
-        message += "⏰ Время подвести итоги!\n\n"
-        message += "📚 Что ты изучал с последнего напоминания?\n"
-        message += "Напиши тему или предмет, который ты изучал."
-        
-        await application.bot.send_message(
-            chat_id=user_id,
-            text=message
-        )
-        
-        logger.info(f"Reminder sent to user {user_id}")
-        
+        interests_str = update.message.text.strip()
+        await process_interests_input(user_id, interests_str, db_user, update)
     except Exception as e:
-        logger.error(f"Error sending reminder to user {user_id}: {e}", exc_info=True)
-        if user_id in user_waiting_for_progress:
-            del user_waiting_for_progress[user_id]
+        logger.error(f"Error handling interests input: {e}", exc_info=True)
+        await conversation_states.clear(user_id)
+        await update.message.reply_text(
+            "❌ Произошла ошибка при обработке. Попробуйте /interests еще раз."
+        )
 
 
-async def check_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Background task to check and send reminders."""
+async def handle_progress_topic(update: Update, context: ContextTypes.DEFAULT_TYPE, state: ConversationState) -> None:
+    """Handle the studied topic sent in reply to a reminder."""
+    user_id = update.message.from_user.id
+    topic = update.message.text.strip()
+    if len(topic) > 200:
+        await update.message.reply_text("Тема слишком длинная. Пожалуйста, укажи короче (до 200 символов).")
+        return
+    
+    await conversation_states.set(user_id, WAITING_PROGRESS_TIME, topic=topic)
+    await update.message.reply_text(
+        f"Отлично! Ты изучал: {topic}\n\n"
+        "⏱ Сколько времени ты потратил? (в минутах)\n"
+        "Например: 30, 60, 120"
+    )
+
+
+async def handle_progress_time(update: Update, context: ContextTypes.DEFAULT_TYPE, state: ConversationState) -> None:
+    """Handle the study time sent after the topic, save progress and show stats."""
+    user_id = update.message.from_user.id
     try:
-        users_due = await get_users_due_for_reminder()
-        for reminder in users_due:
-            await send_reminder_to_user(reminder.user_id, context.application)
+        time_minutes = int(update.message.text.strip())
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, укажи число (в минутах). Например: 30, 60, 120")
+        return
+    
+    if time_minutes <= 0:
+        await update.message.reply_text("Время должно быть положительным числом. Попробуй еще раз.")
+        return
+    if time_minutes > 1440:  # 24 hours
+        await update.message.reply_text("Это слишком много! Максимум 1440 минут (24 часа). Попробуй еще раз.")
+        return
+    
+    db_user = await get_user_by_telegram_id(user_id)
+    if not db_user:
+        await conversation_states.clear(user_id)
+        return
+    
+    topic = state.topic or 'Не указано'
+    
+    # Save progress
+    success = await save_study_progress(user_id, topic, time_minutes)
+    
+    # Clear waiting state
+    await conversation_states.clear(user_id)
+    
+    if not success:
+        await update.message.reply_text("❌ Ошибка при сохранении. Попробуй еще раз.")
+        return
+    
+    # Get stats
+    stats = await get_study_totals(user_id)
+    total_hours = stats['total_time_minutes'] // 60
+    total_minutes = stats['total_time_minutes'] % 60
+    
+    # Motivational messages
+    motivational_msgs = [
+        "🎉 Отличная работа! Продолжай в том же духе!",
+        "💪 Ты делаешь прогресс! Каждый день приближает тебя к цели!",
+        "🌟 Превосходно! Не останавливайся!",
+        "🚀 Ты на правильном пути! У тебя все получается!",
+        "✨ Замечательно! Твои усилия не напрасны!",
+    ]
+    
+    import random
+    motivational = random.choice(motivational_msgs)
+    
+    message = f"{motivational}\n\n"
+    message += "📊 **Твоя статистика:**\n"
+    message += f"Тем изучено: {stats['total_topics']}\n"
+    message += f"Общее время: {total_hours} ч {total_minutes} мин\n"
+    message += f"Дней подряд: {stats['current_streak']}\n\n"
+    message += f"Сегодня ты добавил: {time_minutes} мин изучения по теме '{topic}'"
+    
+    await update.message.reply_text(message, parse_mode='Markdown')
+    
+    # Update reminder date (reminders are stored by internal user ID)
+    await advance_reminder_date(db_user.id)
+
+
+# Conversation state -> handler of the next text message
+STATE_HANDLERS = {
+    WAITING_REMINDER_INTERVAL: handle_reminder_interval_input,
+    WAITING_INTERESTS: handle_interests_input,
+    WAITING_PROGRESS_TOPIC: handle_progress_topic,
+    WAITING_PROGRESS_TIME: handle_progress_time,
+}
+
+
+@instrument
+async def handle_progress_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Route a text message to the handler of the user's conversation state."""
+    user_id = update.message.from_user.id
+    state = await conversation_states.get(user_id)
+    if state is None:
+        return
+    
+    try:
+        await STATE_HANDLERS[state.kind](update, context, state)
     except Exception as e:
-        logger.error(f"Error in check_reminders: {e}", exc_info=True)
+        logger.error(f"Error handling {state.kind} response: {e}", exc_info=True)
+        await conversation_states.clear(user_id)
+        await update.message.reply_text("❌ Произошла ошибка.")
 
 
-def main() -> None:
-    """Start the bot."""
-    # Get bot token from environment variable
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
+async def deliver_outbox_message(message, application: Application) -> None:
+    """Send one outbox message; exceptions go to the outbox worker, which retries or gives up.
     
-    if not token:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
-        print("Error: Please set the TELEGRAM_BOT_TOKEN environment variable.")
+    For a reminder the user starts waiting for the progress topic before the message is sent."""
+    chat_id = message.chat_id
+    if message.kind == 'reminder':
+        await conversation_states.set(chat_id, WAITING_PROGRESS_TOPIC)
+    try:
+        await application.bot.send_message(chat_id=chat_id, text=message.text)
+    except Exception:
+        if message.kind == 'reminder':
+            await conversation_states.clear(chat_id, WAITING_PROGRESS_TOPIC)
+        raise
+    logger.info(f"{message.kind.capitalize()} sent to user {chat_id}", extra=SAMPLED)
+
+
+# Доставка исходящих сообщений с ограничением параллельности и скорости отправки
+outbox_dispatcher = MessageDispatcher()
+
+
+async def send_due_reminders(application: Application, user_ids: list[int] | None = None) -> None:
+    """Queue reminders for users who are due for one and reschedule them.
+    Checks all users unless user_ids is given; either way reminders are read and queued
+    REMINDER_PAGE_SIZE at a time, one transaction per page. The outbox worker delivers them."""
+    if user_ids is None:
+        pages = iter_due_reminders(REMINDER_PAGE_SIZE)
+    else:
+        pages = _due_reminder_pages(user_ids)
+    
+    queued = 0
+    worker = application.bot_data.get('outbox_worker')
+    async for reminders_due in pages:
+        queued += await queue_reminders(
+            reminders_due, (DEFAULT_LOCALE.reminder(reminder.first_name) for reminder in reminders_due)
+        )
+        if worker:
+            worker.wake()  # Доставка первой страницы идёт, пока читаются следующие
+    if queued:
+        logger.info(f"Queued {queued} reminders")
+
+
+async def _due_reminder_pages(user_ids: list[int]):
+    for start in range(0, len(user_ids), REMINDER_PAGE_SIZE):
+        rows = await get_due_reminders(user_ids[start:start + REMINDER_PAGE_SIZE])
+        if rows:
+            yield rows
+
+
+@instrument
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show handler latency, DB and cache statistics (admins only)."""
+    if update.message.from_user.id not in ADMIN_IDS:
+        await update.message.reply_text("Команда доступна только администраторам.")
         return
     
+    cache_stats = get_cache_stats()
+    text = "📈 Статистика бота\n\n" + metrics.format_text() + "\n\n"
+    for name, stats in cache_stats.items():
+        text += f"Кэш {name}: {stats['size']} записей, попаданий {stats['hit_ratio']:.0%}\n"
+    text += f"Пул соединений: {get_pool_status()}\n"
+    text += f"Групповая запись: {write_buffer.stats()}\n"
+    worker = context.application.bot_data.get('outbox_worker')
+    text += f"Outbox: {await get_outbox_counts()}"
+    if worker:
+        text += f", доставка: {worker.stats}"
+    await update.message.reply_text(text)
+
+
+# Only these update types have handlers; Telegram does not send the rest
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+async def post_init_handler(app: Application) -> None:
+    """Run after application initialization - prepare the database and start background tasks."""
     # Initialize database
-    asyncio.run(init_db())
+    await init_db()
     logger.info("Database initialized")
+    write_buffer.start()
     
-    # Define post_init handler for background tasks (must be defined before Application creation)
-    async def post_init_handler(app: Application) -> None:
-        """Run after application initialization - start reminder checker task."""
-        async def reminder_checker_task():
-            """Background task to check reminders periodically."""
-            await asyncio.sleep(60)  # Wait 1 minute after start
-            while True:
-                try:
-                    # Get all users due for reminders
-                    users_due = await get_users_due_for_reminder()
-                    for reminder in users_due:
-                        await send_reminder_to_user(reminder.user_id, app)
-                    # Check every hour
-                    await asyncio.sleep(3600)
-                except asyncio.CancelledError:
-                    logger.info("Reminder checker task cancelled")
-                    break
-                except Exception as e:
-                    logger.error(f"Error in reminder checker task: {e}", exc_info=True)
-                    await asyncio.sleep(3600)  # Wait before retrying
-        
-        # Start the background task
-        asyncio.create_task(reminder_checker_task())
-        logger.info("Reminder checker task started")
+    await conversation_states.backend.load()
+    
+    match_index.build(await get_match_rows())
+    add_interests_listener(match_index.set_mask)
+    add_study_listener(lambda user_id, progress: match_index.touch(user_id, progress.date))
+    logger.info(f"Match index built: {len(match_index)} users")
+    
+    await leaderboards.rebuild()
+    add_interests_listener(leaderboards.on_interests)
+    add_study_listener(leaderboards.on_study)
+    
+    async def leaderboard_task():
+        """Move 7/30-day windows at midnight and rebuild the boards periodically."""
+        last_rebuild = datetime.utcnow()
+        while True:
+            await asyncio.sleep(600)
+            try:
+                leaderboards.expire()
+                if datetime.utcnow() - last_rebuild >= LEADERBOARD_REBUILD_INTERVAL:
+                    await leaderboards.rebuild()
+                    last_rebuild = datetime.utcnow()
+            except Exception as e:
+                logger.error(f"Error updating leaderboards: {e}", exc_info=True)
+    
+    async def purge_states_task():
+        """Drop expired conversation states periodically."""
+        while True:
+            await asyncio.sleep(600)
+            try:
+                purged = await conversation_states.purge_expired()
+                if purged:
+                    logger.info(f"Purged {purged} expired conversation states")
+            except Exception as e:
+                logger.error(f"Error purging conversation states: {e}", exc_info=True)
+    
+    async def compaction_task():
+        """Fold old study progress into monthly summaries and release the freed pages."""
+        while True:
+            await asyncio.sleep(COMPACTION_INTERVAL.total_seconds())
+            try:
+                compacted = await compact_study_progress(datetime.utcnow() - timedelta(days=STUDY_RETENTION_DAYS))
+                released = await vacuum_free_pages()
+                if compacted or released:
+                    logger.info(f"Compacted {compacted} study progress entries, released {released} pages")
+            except Exception as e:
+                logger.error(f"Error compacting study progress: {e}", exc_info=True)
+    
+    scheduler = ReminderScheduler(lambda user_ids: send_due_reminders(app, user_ids))
+    add_reminder_listener(scheduler.schedule)
     
-    # Create the Application with post_init callback
-    application = Application.builder().token(token).post_init(post_init_handler).build()
+    # Keep a reference so the task is not garbage collected
+    app.bot_data['reminder_scheduler_task'] = asyncio.create_task(scheduler.run())
+    app.bot_data['purge_states_task'] = asyncio.create_task(purge_states_task())
+    app.bot_data['leaderboard_task'] = asyncio.create_task(leaderboard_task())
+    if STUDY_RETENTION_DAYS:
+        app.bot_data['compaction_task'] = asyncio.create_task(compaction_task())
+    
+    outbox_worker = OutboxWorker(lambda message: deliver_outbox_message(message, app), outbox_dispatcher)
+    app.bot_data['outbox_worker'] = outbox_worker
+    app.bot_data['outbox_task'] = asyncio.create_task(outbox_worker.run())
+    
+    metrics_file = os.getenv('BOT_METRICS_FILE', 'bot_metrics.prom')
+    if metrics_file:
+        app.bot_data['metrics_task'] = asyncio.create_task(write_prometheus_file_task(metrics_file))
+    logger.info("Reminder scheduler started")
+
+
+async def post_stop_handler(app: Application) -> None:
+    """Run after the application stops - commit buffered writes and flush recorded traffic."""
+    await write_buffer.stop()
+    recorder = app.bot_data.get('traffic_recorder')
+    if recorder:
+        recorder.stop()
+
+
+def build_application(token: str, request: BaseRequest | None = None) -> Application:
+    """Create the Application with all handlers registered.
+    
+    Updates of different users are processed concurrently (BOT_CONCURRENT_UPDATES at once),
+    updates of one user strictly in order. `request` replaces the Bot API transport
+    (used by the load test)."""
+    max_concurrent_updates = int(os.getenv('BOT_CONCURRENT_UPDATES', '32'))
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent_updates))
+        .post_init(post_init_handler)
+        .post_stop(post_stop_handler)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
     
     # Register handlers
     application.add_handler(CommandHandler("start", start))
@@ -749,15 +809,57 @@ def main() -> None:
     application.add_handler(CommandHandler("config", config_command))
     application.add_handler(CommandHandler("interests", users_interests))
     application.add_handler(CommandHandler("reminder", reminder_command))
+    application.add_handler(CommandHandler("match", match_command))
+    application.add_handler(CommandHandler("top", top_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CallbackQueryHandler(button_callback))
     # Handler for reminder responses (must be after command handlers)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_progress_response))
     
+    # Optional recording of incoming updates for replay benchmarks (see replay.py)
+    record_dir = os.getenv('BOT_RECORD_DIR')
+    if record_dir:
+        recorder = TrafficRecorder(
+            record_dir,
+            sample_rate=float(os.getenv('BOT_RECORD_SAMPLE_RATE', '1.0')),
+            max_bytes=int(os.getenv('BOT_RECORD_MAX_MB', '50')) * 1024 * 1024,
+            salt=os.getenv('BOT_RECORD_SALT')
+        )
+        recorder.start()
+        application.bot_data['traffic_recorder'] = recorder
+        application.add_handler(TypeHandler(Update, recorder.handle_update), group=-1)
+    return application
+
+
+def main() -> None:
+    """Start the bot."""
+    # Get bot token from environment variable
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
+        print("Error: Please set the TELEGRAM_BOT_TOKEN environment variable.")
+        return
+    
+    application = build_application(token)
+    
     # Start the bot
-    logger.info("Bot is starting...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    mode = os.getenv('BOT_MODE', 'polling')
+    logger.info(f"Bot is starting in {mode} mode...")
+    if mode == 'webhook':
+        from webhook import run_webhook
+        asyncio.run(run_webhook(
+            application,
+            listen=os.getenv('BOT_WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('BOT_WEBHOOK_PORT', '8080')),
+            path=os.getenv('BOT_WEBHOOK_PATH', '/telegram'),
+            url=os.getenv('BOT_WEBHOOK_URL'),
+            secret_token=os.getenv('BOT_WEBHOOK_SECRET'),
+            allowed_updates=ALLOWED_UPDATES
+        ))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == '__main__':
     main()
-
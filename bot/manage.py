@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, TextIO
+
+from sqlalchemy import Boolean, DateTime, Integer, select, text
+
+from database import (
+    init_db, rebuild_study_totals, compact_study_progress, vacuum_free_pages, engine, _insert,
+    Interest, User, UserInterest, UserReminder, StudyProgress, StudySummary
+)
+
+# Таблицы для export/import в порядке загрузки; outbox, состояния диалогов и study_totals
+# не переносятся: первые два временные, study_totals пересчитывается после импорта
+TRANSFER_TABLES = {model.__tablename__: model.__table__
+                   for model in (Interest, User, UserInterest, UserReminder, StudyProgress, StudySummary)}
+FORMATS = ('jsonl', 'csv')
+
+
+async def rebuild_totals(args: argparse.Namespace) -> None:
+    """Recompute the study_totals rollup from study_progress."""
+    await init_db()
+    count = await rebuild_study_totals()
+    print(f"Rebuilt study totals for {count} users")
+
+
+async def compact(args: argparse.Namespace) -> None:
+    """Fold study progress older than --days into monthly summaries and free the space."""
+    await init_db()
+    started = time.perf_counter()
+    count = await compact_study_progress(datetime.utcnow() - timedelta(days=args.days), args.batch_size)
+    _report("Compacted", "study_progress", count, started)
+    if args.vacuum:
+        # Полный VACUUM переписывает файл целиком и включает auto_vacuum=INCREMENTAL в старой базе
+        async with engine.connect() as conn:
+            await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.execute(text("VACUUM"))
+        print("Vacuumed the database")
+    else:
+        print(f"Released {await vacuum_free_pages()} free pages")
+
+
+def _open(path: str, mode: str) -> TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _from_text(column, value):
+    """Python value of a JSONL or CSV field for `column`."""
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Boolean):
+        return value if isinstance(value, bool) else value.lower() in ('true', '1')
+    if isinstance(column.type, Integer):
+        return int(value)
+    return value
+
+
+async def _export_table(table, path: str, fmt: str, batch_size: int) -> int:
+    """Stream `table` into `path` ordered by primary key. Returns the number of rows."""
+    columns = [column.name for column in table.columns]
+    count = 0
+    with _open(path, 'w') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+        async with engine.connect() as conn:
+            # Потоковое чтение: в памяти не больше batch_size строк при любом размере таблицы
+            result = await conn.stream(
+                select(table).order_by(*table.primary_key.columns).execution_options(yield_per=batch_size)
+            )
+            async for rows in result.partitions():
+                for row in rows:
+                    if writer:
+                        writer.writerow('' if value is None else _to_json(value) for value in row)
+                    else:
+                        f.write(json.dumps({name: _to_json(value) for name, value in zip(columns, row)},
+                                           ensure_ascii=False) + '\n')
+                count += len(rows)
+    return count
+
+
+def _read_rows(table, path: str, fmt: str) -> Iterator[dict]:
+    with _open(path, 'r') as f:
+        if fmt == 'csv':
+            # Пустое поле CSV - NULL (так его пишет export), если колонка допускает NULL
+            records = ({name: None if value == '' and table.columns[name].nullable else value
+                        for name, value in record.items() if name in table.columns}
+                       for record in csv.DictReader(f))
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            yield {column.name: _from_text(column, record[column.name])
+                   for column in table.columns if column.name in record}
+
+
+async def _import_table(table, path: str, fmt: str, batch_size: int) -> int:
+    """Insert the rows of `path` into `table` in one transaction, batch_size rows per INSERT."""
+    # Каталог интересов уже заполнен init_db: совпадающие записи пропускаются
+    statement = _insert(table).on_conflict_do_nothing() if table.name == 'interests' else table.insert()
+    count = 0
+    async with engine.begin() as conn:
+        batch = []
+        for row in _read_rows(table, path, fmt):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                await conn.execute(statement, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            await conn.execute(statement, batch)
+            count += len(batch)
+        if engine.dialect.name == 'postgresql' and 'id' in table.columns:
+            # Явно заданные id не двигают последовательность SERIAL
+            await conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+            ))
+    return count
+
+
+def _selected_tables(args: argparse.Namespace) -> list[str]:
+    unknown = set(args.tables) - set(TRANSFER_TABLES)
+    if unknown:
+        raise SystemExit(f"Unknown tables: {', '.join(sorted(unknown))}")
+    return [name for name in TRANSFER_TABLES if name in args.tables]
+
+
+def _report(action: str, name: str, count: int, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"{action} {name}: {count} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
+
+
+async def export_data(args: argparse.Namespace) -> None:
+    """Write each table to <directory>/<table>.<format>[.gz]."""
+    await init_db()
+    os.makedirs(args.directory, exist_ok=True)
+    for name in _selected_tables(args):
+        path = os.path.join(args.directory, f"{name}.{args.format}" + ('.gz' if args.gzip else ''))
+        started = time.perf_counter()
+        count = await _export_table(TRANSFER_TABLES[name], path, args.format, args.batch_size)
+        _report("Exported", name, count, started)
+
+
+async def import_data(args: argparse.Namespace) -> None:
+    """Load the files written by export into a database without these rows, then rebuild study totals."""
+    await init_db()
+    for name in _selected_tables(args):
+        paths = [os.path.join(args.directory, f"{name}.{fmt}{suffix}") for fmt in FORMATS for suffix in ('', '.gz')]
+        path = next((p for p in paths if os.path.exists(p)), None)
+        if path is None:
+            print(f"Skipped {name}: no file in {args.directory}")
+            continue
+        fmt = 'csv' if '.csv' in os.path.basename(path) else 'jsonl'
+        started = time.perf_counter()
+        count = await _import_table(TRANSFER_TABLES[name], path, fmt, args.batch_size)
+        _report("Imported", name, count, started)
+    count = await rebuild_study_totals()
+    print(f"Rebuilt study totals for {count} users")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintenance commands for the bot database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = subparsers.add_parser('rebuild-totals', help="Recompute study_totals from study_progress")
+    rebuild_parser.set_defaults(func=rebuild_totals)
+
+    compact_parser = subparsers.add_parser('compact', help="Fold old study progress into monthly summaries")
+    compact_parser.add_argument('--days', type=int, default=180, help="keep entries of the last N days")
+    compact_parser.add_argument('--batch-size', type=int, default=1000, help="entries per transaction")
+    compact_parser.add_argument('--vacuum', action='store_true',
+                                help="run a full VACUUM (SQLite; locks the database while it runs)")
+    compact_parser.set_defaults(func=compact)
+
+    export_parser = subparsers.add_parser('export', help="Stream tables to JSONL or CSV files")
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    export_parser.add_argument('--gzip', action='store_true', help="compress the files (.gz)")
+    export_parser.set_defaults(func=export_data)
+
+    import_parser = subparsers.add_parser('import', help="Load tables from files written by export")
+    import_parser.add_argument('directory')
+    import_parser.set_defaults(func=import_data)
+
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument('--tables', nargs='+', default=list(TRANSFER_TABLES), metavar='TABLE',
+                               help=f"default: {' '.join(TRANSFER_TABLES)}")
+        subparser.add_argument('--batch-size', type=int, default=5000, help="rows per fetch or INSERT")
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
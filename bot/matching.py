@@ -0,0 +1,150 @@
+import heapq
+import itertools
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+from sortedcontainers import SortedList
+
+
+class Match(NamedTuple):
+    user_id: int
+    similarity: float
+    common_mask: int
+
+
+class _Bucket:
+    """Users sharing one interests mask, ordered by last study activity.
+
+    `order` keeps (last_active, user_id) sorted, so the most recently active users are
+    read from the end in O(k) and any user, touched or moved in from another mask,
+    lands at their place in O(log n).
+    """
+
+    __slots__ = ('active', 'order', 'idle')
+
+    def __init__(self):
+        self.active: dict[int, datetime] = {}
+        self.order = SortedList()
+        self.idle: dict[int, None] = {}
+
+    def __len__(self) -> int:
+        return len(self.active) + len(self.idle)
+
+    def add(self, user_id: int, last_active: Optional[datetime]) -> None:
+        if last_active is None:
+            self.idle[user_id] = None
+        else:
+            self.active[user_id] = last_active
+            self.order.add((last_active, user_id))
+
+    def remove(self, user_id: int) -> Optional[datetime]:
+        self.idle.pop(user_id, None)
+        last_active = self.active.pop(user_id, None)
+        if last_active is not None:
+            self.order.remove((last_active, user_id))
+        return last_active
+
+    def most_active(self):
+        """(activity, user_id) from most to least recently active."""
+        return reversed(self.order)
+
+
+class MatchIndex:
+    """In-memory inverted index for finding users with similar interests.
+
+    Users are grouped by their interests mask (users.interests_mask) and every interest
+    points to the masks that contain it. A query scores each candidate mask once by Jaccard
+    similarity, so its cost depends on the number of distinct interest combinations,
+    not on the number of users. Ties are broken by the latest study activity.
+    """
+
+    def __init__(self):
+        self._masks: dict[int, int] = {}                  # user_id -> mask
+        self._buckets: dict[int, _Bucket] = {}            # mask -> users
+        self._by_interest: dict[int, set[int]] = {}       # interest bit -> masks
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def build(self, rows: Iterable) -> None:
+        """Replace the index with (user_id, mask, last_active) rows."""
+        self._masks.clear()
+        self._buckets.clear()
+        self._by_interest.clear()
+        for user_id, mask, last_active in rows:
+            self._add(user_id, mask, last_active)
+
+    def _add(self, user_id: int, mask: int, last_active: Optional[datetime]) -> None:
+        if not mask:
+            return
+        self._masks[user_id] = mask
+        bucket = self._buckets.get(mask)
+        if bucket is None:
+            bucket = self._buckets[mask] = _Bucket()
+            for bit in _bits(mask):
+                self._by_interest.setdefault(bit, set()).add(mask)
+        bucket.add(user_id, last_active)
+
+    def _remove(self, user_id: int) -> Optional[datetime]:
+        mask = self._masks.pop(user_id, None)
+        if mask is None:
+            return None
+        bucket = self._buckets[mask]
+        last_active = bucket.remove(user_id)
+        if not bucket:
+            del self._buckets[mask]
+            for bit in _bits(mask):
+                self._by_interest[bit].discard(mask)
+        return last_active
+
+    def set_mask(self, user_id: int, mask: int) -> None:
+        """Move a user to a new interests mask (0 removes them), keeping their activity."""
+        last_active = self._remove(user_id)
+        self._add(user_id, mask, last_active)
+
+    def touch(self, user_id: int, when: datetime) -> None:
+        """Record study activity; the user moves to their place by `when` within their mask."""
+        mask = self._masks.get(user_id)
+        if mask is not None:
+            bucket = self._buckets[mask]
+            bucket.remove(user_id)
+            bucket.add(user_id, when)
+
+    def top_k(self, user_id: int, k: int = 5, mask: Optional[int] = None) -> list[Match]:
+        """Up to k other users most similar to user_id (or to `mask`), best first."""
+        if mask is None:
+            mask = self._masks.get(user_id, 0)
+        if not mask:
+            return []
+
+        candidates = set().union(*(self._by_interest.get(bit, ()) for bit in _bits(mask)))
+        by_similarity: dict[float, list[int]] = {}
+        for other in candidates:
+            similarity = (mask & other).bit_count() / (mask | other).bit_count()
+            by_similarity.setdefault(similarity, []).append(other)
+
+        matches = []
+        for similarity in sorted(by_similarity, reverse=True):
+            buckets = [self._buckets[other] for other in by_similarity[similarity]]
+            # Внутри одной схожести - сначала недавно занимавшиеся, потом остальные
+            ordered = itertools.chain(
+                (user for _, user in heapq.merge(*(b.most_active() for b in buckets), reverse=True)),
+                itertools.chain.from_iterable(b.idle for b in buckets)
+            )
+            for other_user in ordered:
+                if other_user == user_id:
+                    continue
+                matches.append(Match(other_user, similarity, mask & self._masks[other_user]))
+                if len(matches) == k:
+                    return matches
+        return matches
+
+
+def _bits(mask: int) -> list[int]:
+    """Single-bit masks set in `mask`."""
+    bits = []
+    while mask:
+        low_bit = mask & -mask
+        bits.append(low_bit)
+        mask ^= low_bit
+    return bits
@@ -33,20 +33,142 @@ INTERESTS_LIST = [
     "Иностранные языки"
 ]
 
+# Full help shown by /help and the "Помощь" button
+HELP_TEXT = """📖 **Справка по командам**
+
+**Основные команды:**
+
+/start - Начать работу с ботом
+Зарегистрирует вас в системе и покажет приветственное сообщение
+
+/help - Показать эту справку
+Отображает список всех доступных команд
+
+/config - Показать настройки профиля
+Показывает ваши данные и выбранные интересы
+
+/interests - Управление интересами
+Позволяет выбрать или изменить ваши интересы
+
+/reminder - Настройка напоминаний
+Настрой интервал напоминаний о прогрессе (1-7 дней)
+
+/match - Найти единомышленников
+Покажет пользователей с похожими интересами
+
+/top - Рейтинг по времени занятий
+За всё время, 7 или 30 дней; `/top 3` - среди интересующихся темой 3
+
+**Как использовать:**
+
+1. Начните с команды /start для регистрации
+2. Используйте /interests для выбора ваших интересов
+3. Настройте напоминания через /reminder
+4. Просматривайте свой профиль через /config
+
+**Примеры:**
+
+Выбор интересов:
+`/interests 1,3,5`
+
+Настройка напоминаний:
+`/reminder 3` - напоминать каждые 3 дня
+
+**О напоминаниях:**
+
+Бот будет автоматически напоминать тебе о твоем прогрессе. Когда придет напоминание, просто ответь на вопросы:
+- Что ты изучал?
+- Сколько времени потратил?
+
+Бот сохранит твой прогресс и подбодрит тебя! 💪
+
+Также используйте кнопки ниже для быстрого доступа! 👇"""
+
+# /start greetings, {name} - имя пользователя
+WELCOME_NEW_TEMPLATE = """🎉 Добро пожаловать, {name}!
+
+Я дейлик бот - помогу тебе найти единомышленников и интересные темы для обсуждения.
+
+**Для начала работы нужно выбрать интересы!**
+
+Это поможет мне лучше понять, чем ты увлекаешься. 👇"""
+
+WELCOME_BACK_NO_INTERESTS_TEMPLATE = """👋 С возвращением, {name}!
+
+Похоже, ты еще не выбрал свои интересы. Давай это исправим! 👇"""
+
+WELCOME_BACK_TEMPLATE = """👋 С возвращением, {name}!
+
+Используй команды для навигации:
+/help - Справка по командам
+/config - Настройки профиля  
+/interests - Управление интересами
+/reminder - Настройка напоминаний"""
+
+DEFAULT_NAME = "друг"
+
+# Interests selection
+INTERESTS_SELECTION_TITLE = "🎯 **Выбор интересов**\n\n"
+INTERESTS_SELECTION_COMMAND_HINT = "\n\n💡 **Инструкция:**\nОтправьте команду с номерами интересов через запятую.\nПример: `/interests 1,3,5`"
+CURRENT_INTERESTS_TEMPLATE = "Текущие интересы:\n{interests}\n" + "─" * 20 + "\n\n"
+INTERESTS_SELECTION_REPLY_HINT = "\n\n💡 **Инструкция:**\nОтправьте номера интересов через запятую в следующем сообщении.\n**Пример:** `1,3,5`"
+
+# Keyboard buttons
+BUTTON_HELP = "📖 Помощь"
+BUTTON_CONFIG = "⚙️ Настройки"
+
+# User config, заполняется в rendering.py
+CONFIG_TEMPLATE = """⚙️ **Ваши настройки:**
+
+**ID пользователя:** {id}
+**Telegram ID:** {telegram_id}
+**Имя:** {first_name}
+**Фамилия:** {last_name}
+**Username:** @{username}
+**Статус:** {status}
+
+**Ваши интересы:**
+{interests}"""
+NOT_SPECIFIED = "Не указано"
+STATUS_ACTIVE = "Активен"
+STATUS_INACTIVE = "Неактивен"
+NO_INTERESTS_CONFIG = "Интересы не выбраны. Используйте /interests для выбора.\n"
+
+# /match, без Markdown: в username бывают подчёркивания
+MATCH_TITLE = "🤝 Похожие на тебя пользователи:\n\n"
+MATCH_LINE_TEMPLATE = "{number}. {name}{username} - совпадение {similarity:.0%}\n   Общие интересы: {common}\n"
+MATCH_NO_INTERESTS = "Сначала выбери интересы через /interests, чтобы я смог найти единомышленников."
+MATCH_NOT_FOUND = "Пока не нашлось пользователей с похожими интересами. Загляни позже! 🙂"
+
+# Напоминание о прогрессе, {name} - имя пользователя
+REMINDER_TEMPLATE = """👋 Привет, {name}!
+
+⏰ Время подвести итоги!
+
+📚 Что ты изучал с последнего напоминания?
+Напиши тему или предмет, который ты изучал."""
+
+# /top, тоже без Markdown
+TOP_PERIODS = {'all': "за всё время", '7d': "за 7 дней", '30d': "за 30 дней"}
+TOP_BUTTONS = {'all': "Всё время", '7d': "7 дней", '30d': "30 дней"}
+TOP_TITLE_TEMPLATE = "🏆 Рейтинг по времени занятий {period}{interest}\n\n"
+TOP_INTEREST_TEMPLATE = " - {interest}"
+TOP_LINE_TEMPLATE = "{place}. {name} - {hours} ч {minutes} мин\n"
+TOP_MY_RANK_TEMPLATE = "\nТвоё место: {place} из {total}"
+TOP_NOT_RANKED = "\nТебя пока нет в этом рейтинге - сохрани прогресс после напоминания!"
+TOP_EMPTY = "Пока никто не занимался. Стань первым! 💪\n"
+
+def _numbered(items: list[str]) -> str:
+    return "".join(f"{i}. {item}\n" for i, item in enumerate(items, 1))
+
 def format_interests_list(interests: list[str]) -> str:
     """Format interests list for display"""
     if not interests:
         return "У вас пока нет выбранных интересов."
     
-    result = "Ваши интересы:\n"
-    for i, interest in enumerate(interests, 1):
-        result += f"{i}. {interest}\n"
-    return result
+    return "Ваши интересы:\n" + _numbered(interests)
 
 def format_available_interests() -> str:
     """Format available interests for selection"""
-    result = "Доступные интересы:\n"
-    for i, interest in enumerate(INTERESTS_LIST, 1):
-        result += f"{i}. {interest}\n"
-    result += "\nОтправьте номера интересов через запятую (например: 1,3,5)"
-    return result
+    return ("Доступные интересы:\n" + _numbered(INTERESTS_LIST)
+            + "\nОтправьте номера интересов через запятую (например: 1,3,5)")
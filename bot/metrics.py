@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних замеров хранить для расчёта перцентилей
+LATENCY_SAMPLES = 1024
+
+
+class UpdateMetrics:
+    """SQL statements and DB time accumulated while handling one update."""
+
+    __slots__ = ('statements', 'db_time')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+_current_update: contextvars.ContextVar[Optional[UpdateMetrics]] = contextvars.ContextVar(
+    'current_update_metrics', default=None
+)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class HandlerStats:
+    """Call/error counters, latency samples and DB usage of one handler."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.db_statements = 0
+        self.db_time = 0.0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, elapsed: float, update_metrics: UpdateMetrics, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.db_statements += update_metrics.statements
+        self.db_time += update_metrics.db_time
+        self.latencies.append(elapsed)
+
+    def quantiles(self) -> dict[float, float]:
+        values = sorted(self.latencies)
+        return {q: percentile(values, q) for q in (0.5, 0.95, 0.99)}
+
+
+class Metrics:
+    """Registry of handler stats and global DB counters."""
+
+    def __init__(self):
+        self.handlers: dict[str, HandlerStats] = {}
+        self.db_statements = 0
+        self.db_time = 0.0
+        self.started = time.time()
+
+    def handler(self, name: str) -> HandlerStats:
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        return stats
+
+    def format_text(self) -> str:
+        """Human-readable summary for the /stats command."""
+        uptime = int(time.time() - self.started)
+        lines = [f"Uptime: {uptime // 3600} ч {uptime % 3600 // 60} мин",
+                 f"SQL: {self.db_statements} запросов, {self.db_time * 1000:.0f} мс", ""]
+        for name, stats in sorted(self.handlers.items()):
+            if not stats.calls:
+                continue
+            q = stats.quantiles()
+            lines.append(
+                f"{name}: {stats.calls} вызовов, {stats.errors} ошибок\n"
+                f"  p50/p95/p99: {q[0.5] * 1000:.0f}/{q[0.95] * 1000:.0f}/{q[0.99] * 1000:.0f} мс\n"
+                f"  SQL на вызов: {stats.db_statements / stats.calls:.1f}, "
+                f"DB: {stats.db_time / stats.calls * 1000:.1f} мс"
+            )
+        return "\n".join(lines)
+
+    def format_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE bot_handler_latency_seconds summary",
+        ]
+        for name, stats in sorted(self.handlers.items()):
+            for q, value in stats.quantiles().items():
+                lines.append(f'bot_handler_latency_seconds{{handler="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'bot_handler_latency_seconds_sum{{handler="{name}"}} {stats.total_time:.6f}')
+            lines.append(f'bot_handler_latency_seconds_count{{handler="{name}"}} {stats.calls}')
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for name, stats in sorted(self.handlers.items()):
+            lines.append(f'bot_handler_errors_total{{handler="{name}"}} {stats.errors}')
+        lines.append("# TYPE bot_handler_db_statements_total counter")
+        for name, stats in sorted(self.handlers.items()):
+            lines.append(f'bot_handler_db_statements_total{{handler="{name}"}} {stats.db_statements}')
+        lines.append("# TYPE bot_handler_db_seconds_total counter")
+        for name, stats in sorted(self.handlers.items()):
+            lines.append(f'bot_handler_db_seconds_total{{handler="{name}"}} {stats.db_time:.6f}')
+        lines.append("# TYPE bot_db_statements_total counter")
+        lines.append(f"bot_db_statements_total {self.db_statements}")
+        lines.append("# TYPE bot_db_seconds_total counter")
+        lines.append(f"bot_db_seconds_total {self.db_time:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrument(handler):
+    """Decorator recording latency, errors and SQL usage of a handler under its function name."""
+    stats = metrics.handler(handler.__name__)
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        update_metrics = UpdateMetrics()
+        token = _current_update.set(update_metrics)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.record(elapsed, update_metrics, failed)
+            _current_update.reset(token)
+            logger.info(
+                f"{handler.__name__} {'failed' if failed else 'handled'} in {elapsed * 1000:.1f} ms, "
+                f"{update_metrics.statements} SQL",
+                extra={**SAMPLED, 'handler': handler.__name__, 'latency_ms': round(elapsed * 1000, 2)}
+            )
+
+    return wrapper
+
+
+def install_engine_events(engine: AsyncEngine) -> None:
+    """Count SQL statements and DB time via engine events, globally and per update."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        metrics.db_statements += 1
+        metrics.db_time += elapsed
+        update_metrics = _current_update.get()
+        if update_metrics is not None:
+            update_metrics.statements += 1
+            update_metrics.db_time += elapsed
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('query_started'):
+            conn.info['query_started'].pop()
+
+
+def _write_file(path: str, text: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+async def write_prometheus_file_task(path: str, interval: float = 30) -> None:
+    """Periodically write metrics to `path` (atomically, for node_exporter's textfile collector)."""
+    while True:
+        try:
+            await asyncio.to_thread(_write_file, path, metrics.format_prometheus())
+        except Exception as e:
+            logger.error(f"Error writing metrics to {path}: {e}", exc_info=True)
+        await asyncio.sleep(interval)
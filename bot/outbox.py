@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from database import claim_outbox_batch, complete_outbox, delete_sent_outbox
+from dispatcher import MessageDispatcher
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пытаться доставить сообщение и с какими паузами между попытками
+MAX_ATTEMPTS = 8
+BASE_RETRY_DELAY = timedelta(seconds=10)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential back-off after `attempts` failed attempts: 10s, 20s, 40s... up to an hour."""
+    return min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** attempts)
+
+
+def is_permanent(error: Exception) -> bool:
+    """Errors retrying cannot fix: the bot is blocked, the chat is gone, the message is invalid."""
+    return isinstance(error, (Forbidden, BadRequest))
+
+
+class OutboxStats:
+    """Delivery counters since start and throughput of the last batch."""
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_rate = 0.0
+
+    def __str__(self) -> str:
+        return (f"sent={self.sent} retried={self.retried} failed={self.failed} "
+                f"batches={self.batches} last_batch_rate={self.last_batch_rate:.1f} msg/s")
+
+
+class OutboxWorker:
+    """Delivers messages from the outbox table at least once.
+
+    Claims due messages in batches, sends them through a MessageDispatcher (bounded
+    concurrency, global and per-chat rate limits, flood-control waits) and records the
+    results: delivered, retried with exponential back-off, or failed for good after
+    MAX_ATTEMPTS or a permanent error. A message whose worker dies mid-send is claimed
+    again when its lease expires, so a crash can cause a duplicate, never a loss.
+
+    `send(row)` delivers one claimed row (id, chat_id, kind, text, attempts).
+    """
+
+    def __init__(self, send: Callable[..., Awaitable[None]], dispatcher: Optional[MessageDispatcher] = None,
+                 batch_size: int = 200, poll_interval: float = 5.0, lease: timedelta = timedelta(minutes=5),
+                 keep_sent: timedelta = timedelta(days=7)):
+        self.send = send
+        self.dispatcher = dispatcher or MessageDispatcher()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.keep_sent = keep_sent
+        self.stats = OutboxStats()
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        """Start the next batch now instead of after poll_interval (call after enqueueing)."""
+        self._wakeup.set()
+
+    async def run_once(self) -> int:
+        """Claim and deliver one batch. Returns the number of claimed messages."""
+        rows = await claim_outbox_batch(self.batch_size, self.lease)
+        if not rows:
+            return 0
+
+        sent, retries, failures = [], [], []
+        now = datetime.utcnow()
+
+        async def deliver(row) -> bool:
+            try:
+                await self.send(row)
+            except RetryAfter:
+                raise  # Диспетчер подождёт и повторит
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if is_permanent(e) or row.attempts + 1 >= MAX_ATTEMPTS:
+                    failures.append((row.id, error))
+                else:
+                    retries.append((row.id, now + retry_delay(row.attempts), error))
+                return False
+            sent.append(row.id)
+            return True
+
+        started = time.monotonic()
+        await self.dispatcher.dispatch(rows, deliver, key=lambda row: row.chat_id)
+        # Строки без результата исчерпали повторы после RetryAfter внутри диспетчера
+        done = set(sent) | {r[0] for r in retries} | {f[0] for f in failures}
+        retries.extend(
+            (row.id, now + retry_delay(row.attempts), "RetryAfter") for row in rows if row.id not in done
+        )
+        await complete_outbox(sent, retries, failures)
+
+        elapsed = time.monotonic() - started
+        self.stats.sent += len(sent)
+        self.stats.retried += len(retries)
+        self.stats.failed += len(failures)
+        self.stats.batches += 1
+        self.stats.last_batch_rate = len(sent) / elapsed if elapsed > 0 else 0.0
+        if failures:
+            logger.warning(f"Outbox: {len(failures)} messages failed permanently, last error: {failures[-1][1]}")
+        return len(rows)
+
+    async def drain(self) -> None:
+        """Deliver batches until nothing is due."""
+        while await self.run_once():
+            pass
+
+    async def run(self) -> None:
+        """Deliver forever; sleeps up to poll_interval between empty polls."""
+        last_cleanup = 0.0
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    if await self.run_once():
+                        continue
+                    if time.monotonic() - last_cleanup > 3600:
+                        deleted = await delete_sent_outbox(datetime.utcnow() - self.keep_sent)
+                        last_cleanup = time.monotonic()
+                        if deleted:
+                            logger.info(f"Outbox: deleted {deleted} delivered messages")
+                except Exception as e:
+                    logger.error(f"Outbox delivery error: {e}", exc_info=True)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            logger.info("Outbox worker cancelled")
+            raise
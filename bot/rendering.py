@@ -0,0 +1,143 @@
+from types import ModuleType
+from typing import Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, User as TelegramUser
+
+import messages
+from cache import TTLCache, MISSING
+
+
+class Locale:
+    """Texts and keyboards of one language, rendered once when the bot starts.
+
+    Static texts are stored ready to send; parameterized ones keep the bound
+    str.format of their template, so a call does not look anything up.
+    """
+
+    def __init__(self, code: str, texts: ModuleType):
+        self.code = code
+        self.texts = texts
+        self.help_text = texts.HELP_TEXT
+        self.main_keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(texts.BUTTON_HELP, callback_data="help"),
+            InlineKeyboardButton(texts.BUTTON_CONFIG, callback_data="config"),
+        ]])
+        self.available_interests = texts.format_available_interests()
+        self.interests_selection = (
+            texts.INTERESTS_SELECTION_TITLE + self.available_interests + texts.INTERESTS_SELECTION_COMMAND_HINT
+        )
+        self.interests_selection_reply = self.available_interests + texts.INTERESTS_SELECTION_REPLY_HINT
+        self._welcome_new = texts.WELCOME_NEW_TEMPLATE.format
+        self._welcome_back_no_interests = texts.WELCOME_BACK_NO_INTERESTS_TEMPLATE.format
+        self._welcome_back = texts.WELCOME_BACK_TEMPLATE.format
+        self._config = texts.CONFIG_TEMPLATE.format
+        self._current_interests = texts.CURRENT_INTERESTS_TEMPLATE.format
+        self._match_line = texts.MATCH_LINE_TEMPLATE.format
+        self._reminder = texts.REMINDER_TEMPLATE.format
+        self._top_title = texts.TOP_TITLE_TEMPLATE.format
+        self._top_interest = texts.TOP_INTEREST_TEMPLATE.format
+        self._top_line = texts.TOP_LINE_TEMPLATE.format
+        self._top_my_rank = texts.TOP_MY_RANK_TEMPLATE.format
+
+    def welcome(self, first_name: Optional[str], is_new_user: bool, has_interests: bool) -> str:
+        name = first_name or self.texts.DEFAULT_NAME
+        if is_new_user:
+            return self._welcome_new(name=name)
+        if not has_interests:
+            return self._welcome_back_no_interests(name=name)
+        return self._welcome_back(name=name)
+
+    def reminder(self, first_name: Optional[str]) -> str:
+        return self._reminder(name=first_name or self.texts.DEFAULT_NAME)
+
+    def interests_prompt(self, current_interests: list[str]) -> str:
+        """Text of /interests: current interests (if any) and the selection instructions."""
+        if not current_interests:
+            return self.texts.INTERESTS_SELECTION_TITLE + self.interests_selection_reply
+        current = self._current_interests(interests=self.texts.format_interests_list(current_interests))
+        return self.texts.INTERESTS_SELECTION_TITLE + current + self.interests_selection_reply
+
+    def user_config(self, db_user, interests: list[str]) -> str:
+        texts = self.texts
+        return self._config(
+            id=db_user.id,
+            telegram_id=db_user.telegram_id,
+            first_name=db_user.first_name or texts.NOT_SPECIFIED,
+            last_name=db_user.last_name or texts.NOT_SPECIFIED,
+            username=db_user.username or texts.NOT_SPECIFIED,
+            status=texts.STATUS_ACTIVE if db_user.is_active else texts.STATUS_INACTIVE,
+            interests="".join(f"{i}. {interest}\n" for i, interest in enumerate(interests, 1))
+            if interests else texts.NO_INTERESTS_CONFIG
+        )
+
+    def matches(self, rows: list[tuple]) -> str:
+        """Text of /match from (first_name, username, similarity, common interests) rows."""
+        lines = [
+            self._match_line(
+                number=number,
+                name=first_name or self.texts.DEFAULT_NAME,
+                username=f" (@{username})" if username else "",
+                similarity=similarity,
+                common=", ".join(common)
+            )
+            for number, (first_name, username, similarity, common) in enumerate(rows, 1)
+        ]
+        return self.texts.MATCH_TITLE + "".join(lines)
+
+    def top_keyboard(self, interest_id: int) -> InlineKeyboardMarkup:
+        """Window switch buttons of /top; callback data is "top:<window>:<interest_id>"."""
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton(label, callback_data=f"top:{window}:{interest_id}")
+            for window, label in self.texts.TOP_BUTTONS.items()
+        ]])
+
+    def leaderboard(self, window: str, interest: Optional[str], rows: list[tuple],
+                    place: Optional[int], total: int) -> str:
+        """Text of /top from (first_name, minutes) rows and the user's own place."""
+        texts = self.texts
+        text = self._top_title(
+            period=texts.TOP_PERIODS[window],
+            interest=self._top_interest(interest=interest) if interest else ""
+        )
+        text += "".join(
+            self._top_line(place=number, name=first_name or texts.DEFAULT_NAME,
+                           hours=minutes // 60, minutes=minutes % 60)
+            for number, (first_name, minutes) in enumerate(rows, 1)
+        ) or texts.TOP_EMPTY
+        return text + (self._top_my_rank(place=place, total=total) if place else texts.TOP_NOT_RANKED)
+
+
+# Добавить язык: модуль с теми же константами, что и messages.py, и запись здесь
+LOCALES = {
+    'ru': Locale('ru', messages),
+}
+DEFAULT_LOCALE = LOCALES['ru']
+
+
+def get_locale(user: Optional[TelegramUser]) -> Locale:
+    """Locale for the user's Telegram language, falling back to Russian."""
+    if user is None or not user.language_code:
+        return DEFAULT_LOCALE
+    return LOCALES.get(user.language_code[:2], DEFAULT_LOCALE)
+
+
+# Готовый текст /config по (язык, ID пользователя) до изменения его данных
+_config_cache = TTLCache(maxsize=10000, ttl=3600)
+
+
+def get_cached_user_config(locale: Locale, user_id: int) -> Optional[str]:
+    cached = _config_cache.get((locale.code, user_id))
+    return None if cached is MISSING else cached
+
+
+def render_user_config(locale: Locale, db_user, interests: list[str]) -> str:
+    """Render /config text of a user and keep it until invalidate_user_config()."""
+    text = locale.user_config(db_user, interests)
+    _config_cache.set((locale.code, db_user.id), text)
+    return text
+
+
+def invalidate_user_config(user_id: int) -> None:
+    """Drop the rendered /config of a user (call when their profile or interests change)."""
+    for code in LOCALES:
+        _config_cache.invalidate((code, user_id))
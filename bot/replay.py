@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+from telegram import Update
+
+from traffic import anonymize_id, read_capture
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded updates through the bot's handlers against a scratch copy of the database"
+    )
+    parser.add_argument('captures', nargs='+', help="capture files written with BOT_RECORD_DIR (.jsonl.gz)")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="1 = real time, N = N times faster, 0 = as fast as possible (default)")
+    parser.add_argument('--source-db', default='bot.db', help="database to copy (not modified)")
+    parser.add_argument('--db', default='replay.db', help="scratch copy used for the run (recreated)")
+    parser.add_argument('--salt', default=os.getenv('BOT_RECORD_SALT'),
+                        help="BOT_RECORD_SALT of the recording; Telegram IDs in the copy are pseudonymized "
+                             "with it so that recorded users match their rows")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="simulated Bot API round-trip time")
+    return parser.parse_args()
+
+
+def make_scratch_copy(source: str, target: str, salt: str | None) -> None:
+    """Copy the SQLite database consistently (backup API) and pseudonymize Telegram IDs."""
+    if os.path.exists(target):
+        os.remove(target)
+    if os.path.exists(source):
+        with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+            src.backup(dst)
+    if not salt or not os.path.exists(target):
+        return
+    from database import TELEGRAM_ID_COLUMNS  # После BOT_DATABASE_URL: database создаёт engine при импорте
+    with sqlite3.connect(target) as conn:
+        conn.create_function('anonymize_id', 1, lambda value: None if value is None else anonymize_id(value, salt))
+        for table, column in TELEGRAM_ID_COLUMNS:
+            try:
+                conn.execute(f"UPDATE {table} SET {column} = anonymize_id({column})")
+            except sqlite3.OperationalError:
+                pass  # Таблицы нет в старой базе
+
+
+async def run(args: argparse.Namespace) -> None:
+    os.environ['BOT_DATABASE_URL'] = f"sqlite+aiosqlite:///{args.db}"
+    make_scratch_copy(args.source_db, args.db, args.salt)
+    os.environ['BOT_METRICS_FILE'] = ''
+    os.environ.pop('BOT_RECORD_DIR', None)
+
+    import main as bot
+    from fake_api import FakeBotAPI
+    from loadtest import PhaseStats
+    from metrics import metrics
+
+    logging.getLogger().setLevel(logging.WARNING)
+    api = FakeBotAPI(latency=args.api_latency_ms / 1000)
+    app = bot.build_application('123456:replay', request=api)
+    await app.initialize()
+    await bot.post_init_handler(app)
+    statements = metrics.db_statements
+
+    stats = PhaseStats(f"replay x{args.speed:g}" if args.speed else "replay (max speed)")
+
+    async def process(update: Update) -> None:
+        started = time.perf_counter()
+        await app.update_processor.process_update(update, app.process_update(update))
+        stats.latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    first_t = None
+    try:
+        for t, data in read_capture(args.captures):
+            if args.speed:
+                if first_t is None:
+                    first_t = t
+                delay = (t - first_t) / args.speed - (time.perf_counter() - stats.started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # Задачи создаются в порядке записи, процессор сохраняет порядок по пользователю
+            tasks.append(asyncio.create_task(process(Update.de_json(data, app.bot))))
+        await asyncio.gather(*tasks)
+        stats.elapsed = time.perf_counter() - stats.started
+        stats.db_statements = metrics.db_statements - statements
+        stats.api_calls = sum(api.calls.values()) - 1  # без getMe
+        print(stats.report())
+        print(f"Bot API calls: {dict(api.calls)}")
+    finally:
+        for task in app.bot_data.values():
+            if isinstance(task, asyncio.Task):
+                task.cancel()
+        # Как Application.stop(): post_stop дописывает буферизованные записи до shutdown
+        await bot.post_stop_handler(app)
+        await app.shutdown()
+
+
+def main() -> None:
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == '__main__':
+    main()
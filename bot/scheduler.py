@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from database import get_reminder_schedule
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверять расписание с базой на случай пропущенных изменений
+RESYNC_INTERVAL = timedelta(minutes=15)
+
+
+class ReminderScheduler:
+    """Fires reminders at their exact next_reminder_date.
+
+    Upcoming dates are kept in a min-heap; the scheduler sleeps until the earliest one
+    and calls `on_due(user_ids)`. Only reminders due before the next resync are held in
+    memory, later ones are picked up by the periodic resync with the database.
+    Reminders already overdue at a resync (e.g. a backlog after downtime) are not loaded:
+    the scheduler calls `on_due(None)` and the callee pages through them in the database.
+    `schedule()` is meant to be registered with database.add_reminder_listener.
+    """
+
+    def __init__(self, on_due: Callable[[Optional[list[int]]], Awaitable[None]],
+                 resync_interval: timedelta = RESYNC_INTERVAL):
+        self.on_due = on_due
+        self.resync_interval = resync_interval
+        self._heap: list[tuple[datetime, int]] = []
+        # Актуальная дата для каждого пользователя; устаревшие записи кучи пропускаются
+        self._due: dict[int, datetime] = {}
+        self._horizon = datetime.min
+        self._next_resync = datetime.min
+        self._catch_up = False
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, user_id: int, due_at: Optional[datetime]) -> None:
+        """Add, move or (with due_at=None) remove the reminder of a user."""
+        if due_at is None or due_at > self._horizon:
+            self._due.pop(user_id, None)
+            return
+        self._due[user_id] = due_at
+        heapq.heappush(self._heap, (due_at, user_id))
+        if self._heap[0] == (due_at, user_id):
+            self._wakeup.set()
+
+    async def resync(self) -> None:
+        """Reload reminders due before the next resync from the database."""
+        now = datetime.utcnow()
+        self._next_resync = now + self.resync_interval
+        # Небольшой запас, чтобы не потерять напоминания на границе окна
+        self._horizon = self._next_resync + self.resync_interval
+        rows = await get_reminder_schedule(self._horizon, after=now)
+        self._catch_up = True
+        self._due = {row.user_id: row.next_reminder_date for row in rows}
+        self._heap = [(due_at, user_id) for user_id, due_at in self._due.items()]
+        heapq.heapify(self._heap)
+        logger.info(f"Reminder schedule synced: {len(self._due)} reminders until {self._horizon}")
+
+    def _pop_due(self, now: datetime) -> list[int]:
+        user_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) == due_at:
+                del self._due[user_id]
+                user_ids.append(user_id)
+        return user_ids
+
+    def _seconds_to_next_event(self, now: datetime) -> float:
+        # Пропускаем устаревшие записи, чтобы не просыпаться зря
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        next_event = self._next_resync
+        if self._heap:
+            next_event = min(next_event, self._heap[0][0])
+        return max((next_event - now).total_seconds(), 0)
+
+    async def run(self) -> None:
+        """Main loop: sleep until the earliest reminder or resync, then fire due reminders."""
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= self._next_resync:
+                    await self.resync()
+                    now = datetime.utcnow()
+
+                if self._catch_up:
+                    self._catch_up = False
+                    await self.on_due(None)
+                    continue
+
+                user_ids = self._pop_due(now)
+                if user_ids:
+                    await self.on_due(user_ids)
+                    continue
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_to_next_event(now))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                logger.info("Reminder scheduler cancelled")
+                raise
+            except Exception as e:
+                logger.error(f"Error in reminder scheduler: {e}", exc_info=True)
+                # Повторная синхронизация вернёт в расписание неотправленные напоминания
+                self._next_resync = datetime.min
+                await asyncio.sleep(60)
@@ -0,0 +1,133 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import (
+    load_conversation_states, save_conversation_state, delete_conversation_state,
+    delete_expired_conversation_states
+)
+
+logger = logging.getLogger(__name__)
+
+# Виды состояний диалога
+WAITING_INTERESTS = 'interests'
+WAITING_REMINDER_INTERVAL = 'reminder_interval'
+WAITING_PROGRESS_TOPIC = 'progress_topic'
+WAITING_PROGRESS_TIME = 'progress_time'
+
+# Сколько живёт состояние: на ответ на напоминание даём больше времени
+STATE_TTLS = {
+    WAITING_INTERESTS: timedelta(hours=1),
+    WAITING_REMINDER_INTERVAL: timedelta(hours=1),
+    WAITING_PROGRESS_TOPIC: timedelta(days=2),
+    WAITING_PROGRESS_TIME: timedelta(days=2),
+}
+
+
+class ConversationState:
+    """What the bot expects from a user in the next text message."""
+
+    __slots__ = ('kind', 'topic', 'expires_at')
+
+    def __init__(self, kind: str, topic: Optional[str], expires_at: datetime):
+        self.kind = kind
+        self.topic = topic
+        self.expires_at = expires_at
+
+    def is_expired(self, now: datetime) -> bool:
+        return self.expires_at <= now
+
+
+class MemoryStateBackend:
+    """Keeps states in a dict; they are lost on restart."""
+
+    def __init__(self):
+        self._states: dict[int, ConversationState] = {}
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    async def load(self) -> None:
+        pass
+
+    async def get(self, user_id: int) -> Optional[ConversationState]:
+        return self._states.get(user_id)
+
+    async def set(self, user_id: int, state: ConversationState) -> None:
+        self._states[user_id] = state
+
+    async def delete(self, user_id: int) -> None:
+        self._states.pop(user_id, None)
+
+    async def purge(self, now: datetime) -> int:
+        expired = [user_id for user_id, state in self._states.items() if state.is_expired(now)]
+        for user_id in expired:
+            del self._states[user_id]
+        return len(expired)
+
+
+class DatabaseStateBackend(MemoryStateBackend):
+    """Reads from memory and writes through to the conversation_states table,
+    so that unfinished conversations survive a restart."""
+
+    async def load(self) -> None:
+        for row in await load_conversation_states():
+            self._states[row.user_id] = ConversationState(row.kind, row.topic, row.expires_at)
+        logger.info(f"Loaded {len(self._states)} conversation states")
+
+    async def set(self, user_id: int, state: ConversationState) -> None:
+        await super().set(user_id, state)
+        await save_conversation_state(user_id, state.kind, state.topic, state.expires_at)
+
+    async def delete(self, user_id: int) -> None:
+        if user_id in self._states:
+            await super().delete(user_id)
+            await delete_conversation_state(user_id)
+
+    async def purge(self, now: datetime) -> int:
+        count = await super().purge(now)
+        await delete_expired_conversation_states()
+        return count
+
+
+STATE_BACKENDS = {
+    'memory': MemoryStateBackend,
+    'sqlite': DatabaseStateBackend,
+}
+
+
+class StateStore:
+    """Conversation states keyed by Telegram user ID, one state per user, expiring on TTL."""
+
+    def __init__(self, backend: MemoryStateBackend):
+        self.backend = backend
+
+    async def get(self, user_id: int) -> Optional[ConversationState]:
+        state = await self.backend.get(user_id)
+        if state is not None and state.is_expired(datetime.utcnow()):
+            await self.backend.delete(user_id)
+            return None
+        return state
+
+    async def set(self, user_id: int, kind: str, topic: Optional[str] = None) -> None:
+        """Replace the user's state; it expires after STATE_TTLS[kind]."""
+        expires_at = datetime.utcnow() + STATE_TTLS[kind]
+        await self.backend.set(user_id, ConversationState(kind, topic, expires_at))
+
+    async def clear(self, user_id: int, kind: Optional[str] = None) -> None:
+        """Drop the user's state (only if it is of `kind`, when given)."""
+        if kind is not None:
+            state = await self.backend.get(user_id)
+            if state is None or state.kind != kind:
+                return
+        await self.backend.delete(user_id)
+
+    async def purge_expired(self) -> int:
+        return await self.backend.purge(datetime.utcnow())
+
+
+def create_state_store(backend_name: str) -> StateStore:
+    """Create a store with the backend named in STATE_BACKENDS."""
+    if backend_name not in STATE_BACKENDS:
+        raise ValueError(f"Unknown state backend '{backend_name}', expected one of: {', '.join(STATE_BACKENDS)}")
+    return StateStore(STATE_BACKENDS[backend_name]())
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Объекты update, в которых есть ID и имена пользователей или чатов
+_PERSON_KEYS = ('from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat')
+
+
+def anonymize_id(value: int, salt: str) -> int:
+    """Map a Telegram user/chat ID to a stable pseudonymous ID (same salt - same result)."""
+    digest = hmac.new(salt.encode(), str(value).encode(), hashlib.sha256).digest()
+    return 10 ** 12 + int.from_bytes(digest[:6], 'big')
+
+
+def anonymize_update(data: dict, salt: str) -> dict:
+    """Replace user/chat IDs with pseudonyms and drop names, recursively, in update JSON."""
+    result = {}
+    for key, value in data.items():
+        if key in _PERSON_KEYS and isinstance(value, dict):
+            person = {k: v for k, v in value.items() if k not in ('first_name', 'last_name', 'username', 'title')}
+            if 'id' in person:
+                person['id'] = anonymize_id(person['id'], salt)
+            if 'first_name' in value:
+                person['first_name'] = "User"
+            result[key] = anonymize_update(person, salt)
+        elif key == 'chat_instance':
+            result[key] = str(anonymize_id(int(value), salt))
+        elif isinstance(value, dict):
+            result[key] = anonymize_update(value, salt)
+        elif isinstance(value, list):
+            result[key] = [anonymize_update(v, salt) if isinstance(v, dict) else v for v in value]
+        else:
+            result[key] = value
+    return result
+
+
+class TrafficRecorder:
+    """Records incoming updates to rotating gzip-compressed JSONL files.
+
+    record() only puts the update on a bounded queue (dropping it when the queue is full);
+    anonymization, compression and file I/O happen in a background thread. Sampling is
+    per user, so sampled users' conversations are recorded completely.
+    Each line is {"t": <unix time>, "update": <anonymized update JSON>}.
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 1.0, max_bytes: int = 50 * 1024 * 1024,
+                 salt: Optional[str] = None, queue_size: int = 10000):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.salt = salt or os.urandom(16).hex()
+        self.recorded = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name='traffic-recorder', daemon=True)
+        self._file_index = 0
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+        logger.info(f"Recording {self.sample_rate:.0%} of users' updates to {self.directory}")
+
+    def stop(self) -> None:
+        """Flush queued updates and close the current file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        logger.info(f"Traffic recorder stopped: {self.recorded} recorded, {self.dropped} dropped")
+
+    def _sampled(self, update: Update) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        key = update.effective_user.id if update.effective_user else update.update_id
+        return anonymize_id(key, self.salt) % 10000 < self.sample_rate * 10000
+
+    def record(self, update: Update) -> None:
+        if not self._sampled(update):
+            return
+        try:
+            self._queue.put_nowait((time.time(), update.to_dict()))
+        except queue.Full:
+            self.dropped += 1
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """TypeHandler callback; register it in a group before the bot's handlers."""
+        self.record(update)
+
+    def _open_next_file(self):
+        self._file_index += 1
+        name = f"updates-{datetime.utcnow():%Y%m%d-%H%M%S}-{self._file_index}.jsonl.gz"
+        return gzip.open(os.path.join(self.directory, name), 'wt', encoding='utf-8')
+
+    def _write_loop(self) -> None:
+        file, written, last_flush = None, 0, time.monotonic()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if file is None or written >= self.max_bytes:
+                    if file is not None:
+                        file.close()
+                    file, written = self._open_next_file(), 0
+                received_at, data = item
+                line = json.dumps({'t': received_at, 'update': anonymize_update(data, self.salt)},
+                                  ensure_ascii=False) + '\n'
+                file.write(line)
+                written += len(line)
+                self.recorded += 1
+                # Сбрасываем буфер, когда очередь опустела, но не чаще раза в секунду
+                if self._queue.empty() and time.monotonic() - last_flush > 1:
+                    file.flush()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            logger.error(f"Traffic recorder failed: {e}", exc_info=True)
+        finally:
+            if file is not None:
+                file.close()
+
+
+def read_capture(paths: list[str]):
+    """Yield (t, update JSON) from capture files in order of the files given."""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['t'], record['update']
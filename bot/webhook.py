@@ -0,0 +1,102 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def create_webhook_app(application: Application, path: str, secret_token: Optional[str]) -> web.Application:
+    """aiohttp app that feeds POSTed updates into the bot's update queue.
+
+    POST `path` - Telegram update JSON, checked against the secret token header
+    GET /health - liveness check with the current update queue size
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except (ValueError, json.JSONDecodeError):
+            return web.Response(status=400, text="Invalid JSON")
+        if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+            return web.Response(status=400, text="Not a Telegram update")
+        try:
+            update = Update.de_json(data, application.bot)
+        except (TypeError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Rejected malformed update {data.get('update_id')}: {e}")
+            return web.Response(status=400, text="Not a Telegram update")
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok' if application.running else 'starting',
+            'update_queue_size': application.update_queue.qsize()
+        })
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    web_app.router.add_get('/health', health)
+    return web_app
+
+
+async def run_webhook(application: Application, listen: str, port: int, path: str,
+                      url: Optional[str], secret_token: Optional[str], allowed_updates: list[str]) -> None:
+    """Serve updates over HTTP until SIGINT/SIGTERM.
+
+    If `url` is empty the webhook is not registered with Telegram, which is handy for
+    POSTing recorded updates to a local instance.
+    """
+    if not secret_token:
+        logger.warning("BOT_WEBHOOK_SECRET is not set, webhook requests are not authenticated")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    runner = web.AppRunner(create_webhook_app(application, path, secret_token))
+    async with application:
+        # run_polling/run_webhook call post_init themselves, here it is our job
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(f"Webhook server listening on {listen}:{port}{path}")
+
+        if url:
+            await application.bot.set_webhook(
+                url=url.rstrip('/') + path,
+                secret_token=secret_token or None,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=False
+            )
+            logger.info(f"Webhook registered at {url.rstrip('/')}{path}")
+        else:
+            logger.info("BOT_WEBHOOK_URL is not set, webhook is not registered with Telegram")
+
+        try:
+            await stop.wait()
+        finally:
+            logger.info("Stopping webhook server...")
+            await runner.cleanup()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Операция записи: получает открытую сессию, не делает commit сама
+WriteOp = Callable[[Any], Awaitable[Any]]
+
+
+class GroupCommitWriter:
+    """Single writer task that commits queued write operations in groups.
+
+    submit(op) queues `op(session)` and waits until the transaction containing it is
+    committed. The writer collects up to `max_batch` operations, or whatever arrived within
+    `max_delay` seconds of the first one, runs them in one session and commits once, so
+    many users' writes share one transaction and one fsync. If any operation of a group
+    fails, the group is rolled back and its operations are retried one per transaction,
+    so only the failing caller gets the exception.
+
+    Each operation runs in a copy of its caller's context, so context variables such as
+    the per-update SQL metrics and the logging context see it as the caller's work.
+    """
+
+    def __init__(self, session_factory: Callable, max_batch: int = 64, max_delay: float = 0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Commit what is queued and stop the writer task."""
+        if self.running:
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+        # Записи, поставленные в очередь уже после None
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                await self._commit_group([item])
+
+    async def submit(self, op: WriteOp) -> Any:
+        """Queue a write and return its result once it is committed."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future, contextvars.copy_context()))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'avg_batch': self.operations / self.batches if self.batches else 0.0,
+        }
+
+    async def _collect(self, first) -> tuple[list, bool]:
+        batch, stopping = [first], False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    @staticmethod
+    async def _run_op(op: WriteOp, session) -> Any:
+        result = await op(session)
+        await session.flush()  # Следующая операция видит результат предыдущей
+        return result
+
+    async def _commit_group(self, batch: list) -> None:
+        results = []
+        try:
+            async with self.session_factory() as session:
+                for op, _, context in batch:
+                    results.append(await asyncio.create_task(self._run_op(op, session), context=context))
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                _, future, _ = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            logger.warning(f"Group commit of {len(batch)} writes failed ({e}), retrying them one by one")
+            for item in batch:
+                await self._commit_group([item])
+            return
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch, stopping = await self._collect(first)
+            await self._commit_group(batch)
+            if stopping:
+                return